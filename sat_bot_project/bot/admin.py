@@ -80,10 +80,20 @@
 #     def module2_score(self, obj):
 #         return f"{obj.module2_correct}/{obj.module2_total}"
 #     module2_score.short_description = 'Module 2'
-from django.contrib import admin
-from django.utils.html import format_html
+from django import forms
+from django.contrib import admin, messages
+from django.db.models import Count, Q
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.utils import timezone
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils.html import format_html, format_html_join
 from django.utils.safestring import mark_safe
-from .models import User, Test, Question, TestResult
+from .models import User, Test, Question, TestResult, BotSession
+from .cache import invalidate_test, warm_test
+from .export import csv_lines, result_rows
+from .importer import QuestionImportError, import_tests
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -99,6 +109,10 @@ class QuestionInline(admin.TabularInline):
               'option_c', 'option_d', 'correct_answer']
 
 
+class ImportTestsForm(forms.Form):
+    file = forms.FileField(help_text='CSV or JSONL with one question per row, or a ZIP of one of them plus images')
+
+
 @admin.register(Test)
 class TestAdmin(admin.ModelAdmin):
     list_display = ['name', 'status_display', 'question_count_display', 'is_active', 'created_date']
@@ -107,24 +121,77 @@ class TestAdmin(admin.ModelAdmin):
     readonly_fields = ['is_complete', 'created_date', 'question_summary']
     inlines = [QuestionInline]
     fields = ['name', 'description', 'image', 'is_active']
+    change_list_template = 'admin/bot/test/change_list.html'
+    
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='bot_test_import'),
+        ] + super().get_urls()
+    
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            return redirect('admin:bot_test_changelist')
+        form = ImportTestsForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            imported = skipped = 0
+            try:
+                for result in import_tests(upload.file, upload.name):
+                    if isinstance(result, QuestionImportError):
+                        skipped += 1
+                        messages.error(request, f'Skipped {result}')
+                    else:
+                        imported += 1
+            except QuestionImportError as error:
+                messages.error(request, str(error))
+            if imported:
+                messages.success(request, f'Imported {imported} tests')
+            if not skipped:
+                return redirect('admin:bot_test_changelist')
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'form': form,
+            'title': 'Import tests',
+        }
+        return TemplateResponse(request, 'admin/bot/test/import.html', context)
+    
+    def get_queryset(self, request):
+        # Count both modules in the changelist query instead of two queries per row
+        return super().get_queryset(request).annotate(
+            module1_count=Count('questions', filter=Q(questions__module=1)),
+            module2_count=Count('questions', filter=Q(questions__module=2)),
+        )
+    
+    @staticmethod
+    def question_counts(obj):
+        if not hasattr(obj, 'module1_count'):
+            return obj.get_question_counts()
+        return {
+            'module1': obj.module1_count,
+            'module2': obj.module2_count,
+            'total': obj.module1_count + obj.module2_count
+        }
     
     def save_related(self, request, form, formsets, change):
         super().save_related(request, form, formsets, change)
         test = form.instance
-        module1_count = test.questions.filter(module=1).count()
-        module2_count = test.questions.filter(module=2).count()
-        test.is_complete = module1_count == 27 and module2_count == 27
+        counts = test.get_question_counts()
+        test.is_complete = counts['module1'] == 27 and counts['module2'] == 27
         test.save(update_fields=['is_complete'])
+        invalidate_test(test.pk)
+        if test.is_complete:
+            warm_test(test.pk)
     
     def status_display(self, obj):
-        counts = obj.get_question_counts()
+        counts = self.question_counts(obj)
         is_complete = counts['module1'] == 27 and counts['module2'] == 27
         if is_complete:
             return mark_safe('<span style="color: green;">✅ Complete</span>')
         return mark_safe('<span style="color: orange;">⚠️ Incomplete</span>')
     status_display.short_description = 'Status'
     def question_count_display(self, obj):
-        counts = obj.get_question_counts()
+        counts = self.question_counts(obj)
         m1_color = "green" if counts['module1'] == 27 else "red"
         m2_color = "green" if counts['module2'] == 27 else "red"
 
@@ -137,7 +204,7 @@ class TestAdmin(admin.ModelAdmin):
     
     def question_summary(self, obj):
         if obj.pk:
-            counts = obj.get_question_counts()
+            counts = self.question_counts(obj)
             is_complete = counts['module1'] == 27 and counts['module2'] == 27
             status_text = '✅ Test is complete and ready!' if is_complete else '⚠️ Add more questions to complete the test'
             
@@ -158,16 +225,67 @@ class TestAdmin(admin.ModelAdmin):
 
 @admin.register(Question)
 class QuestionAdmin(admin.ModelAdmin):
-    list_display = ['test', 'module', 'question_number', 'correct_answer', 'has_image']
+    list_display = ['test', 'module', 'question_number', 'correct_answer', 'has_image',
+                    'p_value', 'discrimination', 'item_flag']
     list_filter = ['test', 'module']
     search_fields = ['question_text', 'test__name']
     ordering = ['test', 'module', 'question_number']
-    fields = ['test', 'module', 'question_number', 'question_text', 'image', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer']
+    list_select_related = ['test', 'statistic']
+    fields = ['test', 'module', 'question_number', 'question_text', 'image', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer', 'item_statistics']
+    readonly_fields = ['item_statistics']
     
     def has_image(self, obj):
         return bool(obj.image)
     has_image.boolean = True
     has_image.short_description = 'Image'
+    
+    def p_value(self, obj):
+        statistic = getattr(obj, 'statistic', None)
+        return f"{statistic.p_value:.2f}" if statistic else '-'
+    p_value.short_description = 'p-value'
+    p_value.admin_order_field = 'statistic__p_value'
+    
+    def discrimination(self, obj):
+        statistic = getattr(obj, 'statistic', None)
+        return f"{statistic.discrimination:.2f}" if statistic else '-'
+    discrimination.short_description = 'Discrimination'
+    discrimination.admin_order_field = 'statistic__discrimination'
+    
+    def item_flag(self, obj):
+        statistic = getattr(obj, 'statistic', None)
+        if not statistic:
+            return ''
+        if statistic.discrimination < 0:
+            return '⚠️ Check the key'
+        if statistic.p_value < 0.2:
+            return '⚠️ Very hard'
+        if statistic.p_value > 0.95:
+            return 'Very easy'
+        if statistic.discrimination < 0.2:
+            return 'Weak discrimination'
+        return ''
+    item_flag.short_description = 'Review'
+    
+    def item_statistics(self, obj):
+        statistic = getattr(obj, 'statistic', None)
+        if not statistic:
+            return 'Not analyzed yet (python manage.py item_analysis)'
+        shares = format_html_join(
+            ', ', '{}{}: {}%',
+            (
+                ('✅ ' if letter == obj.correct_answer else '', letter, round(share * 100))
+                for letter, share in [
+                    ('A', statistic.chose_a), ('B', statistic.chose_b), ('C', statistic.chose_c),
+                    ('D', statistic.chose_d), ('Blank', statistic.unanswered),
+                ]
+            ),
+        )
+        return format_html(
+            'p-value {}, discrimination {} over {} attempts<br>{}<br><small>Computed {}</small>',
+            f"{statistic.p_value:.2f}", f"{statistic.discrimination:.2f}", statistic.attempts, shares,
+            statistic.computed_date,
+        )
+    item_statistics.short_description = 'Item analysis'
 
 
 @admin.register(TestResult)
@@ -175,10 +293,22 @@ class TestResultAdmin(admin.ModelAdmin):
     list_display = ['user', 'test', 'estimated_score', 'module1_score', 'module2_score', 'test_date']
     list_filter = ['test', 'test_date']
     search_fields = ['user__first_name', 'user__last_name', 'user__phone']
+    list_select_related = ['user', 'test']
+    date_hierarchy = 'test_date'
+    actions = ['export_csv']
     readonly_fields = ['user', 'test', 'test_date', 'module1_correct', 'module1_total',
                        'module2_correct', 'module2_total', 'estimated_score',
                        'module1_time_taken', 'module2_time_taken']
     
+    @admin.action(description='Export selected results as CSV')
+    def export_csv(self, request, queryset):
+        # Streamed a chunk at a time: "Select all" of a filtered list exports
+        # every matching result without loading them into memory
+        response = StreamingHttpResponse(csv_lines(result_rows(queryset)), content_type='text/csv')
+        filename = f'results-{timezone.now():%Y%m%d-%H%M}.csv'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
     def module1_score(self, obj):
         return f"{obj.module1_correct}/{obj.module1_total}"
     module1_score.short_description = 'Module 1'
@@ -186,3 +316,11 @@ class TestResultAdmin(admin.ModelAdmin):
     def module2_score(self, obj):
         return f"{obj.module2_correct}/{obj.module2_total}"
     module2_score.short_description = 'Module 2'
+
+
+@admin.register(BotSession)
+class BotSessionAdmin(admin.ModelAdmin):
+    list_display = ['telegram_id', 'updated_date']
+    search_fields = ['telegram_id']
+    readonly_fields = ['telegram_id', 'updated_date']
+    exclude = ['data']
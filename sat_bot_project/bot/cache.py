@@ -0,0 +1,163 @@
+from collections import OrderedDict, namedtuple
+from itertools import count
+from django.conf import settings
+from .db import database_sync_to_async
+import threading
+import time
+
+from .models import Question, User
+from .render import question_screens
+
+
+class LRUCache:
+    """Small thread-safe LRU cache with optional TTL and hit/miss counters"""
+
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, stored_at = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate_where(self, predicate):
+        """Drop every entry whose key matches predicate"""
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Ordered questions of one test module with its compiled answer key (one
+# ASCII letter per question) and pre-rendered screens (see
+# render.question_screens), keyed by (test_id, module). Signals invalidate
+# entries in this process; the TTL bounds staleness when the admin runs in a
+# different process than the bot.
+ModuleBank = namedtuple('ModuleBank', ['questions', 'answer_key', 'screens'])
+
+question_bank = LRUCache(
+    maxsize=getattr(settings, 'QUESTION_CACHE_SIZE', 256),
+    ttl=getattr(settings, 'QUESTION_CACHE_TTL', 300),
+)
+
+# Stamp of each test's last invalidation. A load that started before the
+# stamp changed may have read the old questions, so it is not cached.
+_test_generations = {}
+_generation = count(1)
+
+
+def test_generation(test_id):
+    return _test_generations.get(test_id, 0)
+
+
+def load_module_bank(test_id, module):
+    """Load a module's ordered questions from the database"""
+    questions = tuple(Question.objects.filter(
+        test_id=test_id,
+        module=module
+    ).order_by('question_number'))
+    answer_key = ''.join(question.correct_answer for question in questions).encode('ascii')
+    return ModuleBank(questions=questions, answer_key=answer_key, screens=question_screens(questions, module))
+
+
+async def get_module_bank(test_id, module):
+    """Return the cached question bank for a test module, loading it on a miss"""
+    key = (test_id, module)
+    bank = question_bank.get(key)
+    if bank is None:
+        generation = test_generation(test_id)
+        bank = await database_sync_to_async(load_module_bank)(test_id, module)
+        if test_generation(test_id) == generation:
+            question_bank.set(key, bank)
+    return bank
+
+
+async def get_module_questions(test_id, module):
+    """Return the ordered questions of a test module"""
+    bank = await get_module_bank(test_id, module)
+    return bank.questions
+
+
+def warm_test(test_id):
+    """Compile both modules of a test into the cache ahead of the first student"""
+    generation = test_generation(test_id)
+    banks = {module: load_module_bank(test_id, module) for module in (1, 2)}
+    if test_generation(test_id) == generation:
+        for module, bank in banks.items():
+            question_bank.set((test_id, module), bank)
+
+
+def invalidate_test(test_id):
+    """Forget every cached module of a test, and any load of it in progress"""
+    _test_generations[test_id] = next(_generation)
+    question_bank.invalidate_where(lambda key: key[0] == test_id)
+
+
+# Profile ({'phone', 'first_name', 'last_name'}) of each registered user by
+# Telegram id. Only found users are cached, so a new registration is seen at
+# once; signals drop an entry when its User row changes.
+user_profiles = LRUCache(
+    maxsize=getattr(settings, 'USER_CACHE_SIZE', 4096),
+    ttl=getattr(settings, 'USER_CACHE_TTL', 600),
+)
+
+
+def load_user_profile(telegram_id):
+    """Load the profile of the user with a Telegram id, or None"""
+    return User.objects.filter(telegram_id=telegram_id).values('phone', 'first_name', 'last_name').first()
+
+
+async def get_user_profile(telegram_id):
+    """Return the cached profile of the user with a Telegram id, or None"""
+    profile = user_profiles.get(telegram_id)
+    if profile is None:
+        profile = await database_sync_to_async(load_user_profile)(telegram_id)
+        if profile is not None:
+            user_profiles.set(telegram_id, profile)
+    return profile and dict(profile)
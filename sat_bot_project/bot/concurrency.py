@@ -0,0 +1,80 @@
+from telegram.ext import BaseUpdateProcessor
+import asyncio
+import contextlib
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates of different chats concurrently and updates of one chat in order.
+
+    Each chat gets an asyncio.Lock (FIFO) that is created when its first
+    update arrives and dropped once nothing is waiting on it, so the number of
+    locks never exceeds the number of updates in flight. An update takes one
+    of the max_concurrent_updates slots only once it holds its chat's lock, so
+    a burst from one chat occupies a single slot and never starves other chats.
+    """
+
+    __slots__ = ('_locks',)
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}
+
+    @contextlib.asynccontextmanager
+    async def chat_lock(self, chat_id):
+        """Hold the chat's lock; it is garbage-collected when the last holder leaves"""
+        entry = self._locks.get(chat_id)
+        if entry is None:
+            entry = self._locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[chat_id]
+
+    @property
+    def active_chats(self):
+        return len(self._locks)
+
+    async def process_update(self, update, coroutine):
+        # The base class takes the concurrency slot before do_process_update;
+        # waiting for the chat's turn first keeps queued taps from holding slots
+        chat = getattr(update, 'effective_chat', None)
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+        async with self.chat_lock(chat.id):
+            await super().process_update(update, coroutine)
+
+    async def do_process_update(self, update, coroutine):
+        await coroutine
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+def chat_lock(application, chat_id):
+    """The chat's ordering lock, or a no-op when updates are processed sequentially"""
+    processor = application.update_processor
+    if isinstance(processor, ChatOrderedUpdateProcessor):
+        return processor.chat_lock(chat_id)
+    return contextlib.nullcontext()
+
+
+def schedule_followup(context, chat_id, delay, callback, *args, update=None):
+    """Run callback(*args) after delay seconds instead of sleeping inside the handler.
+
+    The follow-up takes the chat's lock, so it stays ordered with the user's
+    other taps, and errors are reported through the application's error handlers.
+    """
+    async def followup():
+        await asyncio.sleep(delay)
+        async with chat_lock(context.application, chat_id):
+            await callback(*args)
+
+    context.application.create_task(followup(), update=update)
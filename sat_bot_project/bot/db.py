@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections
+from asgiref.sync import sync_to_async
+import functools
+
+# Worker threads for the bot's database calls. sync_to_async() defaults to
+# thread_sensitive=True, which runs every query of every chat on one shared
+# thread; these threads each keep their own connection instead, so at most
+# BOT_DB_THREADS queries run at once.
+executor = ThreadPoolExecutor(
+    max_workers=settings.BOT_DB_THREADS,
+    thread_name_prefix='bot-db',
+)
+
+
+def database_sync_to_async(func):
+    """Run a synchronous ORM function in the bot's database pool.
+
+    Usable as a decorator or as a wrapper like sync_to_async. Connections
+    that are past CONN_MAX_AGE or broken are closed before the call, as
+    Django does around each request.
+    """
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        close_old_connections()
+        return func(*args, **kwargs)
+
+    return sync_to_async(call, thread_sensitive=False, executor=executor)
@@ -0,0 +1,116 @@
+from datetime import datetime, time, timezone
+import csv
+
+from .models import TestResult
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Results fetched per round trip (a server-side cursor on PostgreSQL)
+CHUNK_SIZE = 2000
+# (header, field) of each exported column, joined with the user and the test
+COLUMNS = (
+    ('result_id', 'id'),
+    ('test_date', 'test_date'),
+    ('phone', 'user__phone'),
+    ('first_name', 'user__first_name'),
+    ('last_name', 'user__last_name'),
+    ('telegram_id', 'user__telegram_id'),
+    ('test_id', 'test_id'),
+    ('test', 'test__name'),
+    ('module1_correct', 'module1_correct'),
+    ('module1_total', 'module1_total'),
+    ('module2_correct', 'module2_correct'),
+    ('module2_total', 'module2_total'),
+    ('estimated_score', 'estimated_score'),
+    ('module1_time_taken', 'module1_time_taken'),
+    ('module2_time_taken', 'module2_time_taken'),
+    ('answers', 'answers'),
+)
+HEADERS = [header for header, _ in COLUMNS]
+# Text typed by students and staff; spreadsheets run such a cell starting
+# with one of FORMULA_PREFIXES as a formula, so CSV cells get a leading '
+TEXT_COLUMNS = frozenset(index for index, (header, _) in enumerate(COLUMNS)
+                         if header in ('phone', 'first_name', 'last_name', 'test'))
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def filter_results(queryset=None, since=None, until=None, tests=None):
+    """Results finished on the dates since..until (inclusive, UTC) of the given tests"""
+    queryset = TestResult.objects.all() if queryset is None else queryset
+    if since:
+        queryset = queryset.filter(test_date__gte=datetime.combine(since, time.min, timezone.utc))
+    if until:
+        queryset = queryset.filter(test_date__lte=datetime.combine(until, time.max, timezone.utc))
+    if tests:
+        queryset = queryset.filter(test_id__in=tests)
+    return queryset
+
+
+def result_rows(queryset, chunk_size=CHUNK_SIZE):
+    """Yield a tuple per result in COLUMNS order, holding one chunk in memory at a time"""
+    # Ordered by the primary key so the database streams the rows without sorting the table
+    return (
+        queryset.order_by('pk')
+        .values_list(*(field for _, field in COLUMNS))
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+class Echo:
+    """File-like object whose write returns the line, for csv.writer in a generator"""
+
+    def write(self, value):
+        return value
+
+
+def spreadsheet_safe(value):
+    """A text cell that a spreadsheet shows as text instead of running it"""
+    if value and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_lines(rows):
+    """Yield the CSV header and then a line per row"""
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADERS)
+    for row in rows:
+        yield writer.writerow([
+            spreadsheet_safe(value) if index in TEXT_COLUMNS else value
+            for index, value in enumerate(row)
+        ])
+
+
+def parquet_schema():
+    types = {'test_date': pa.timestamp('us', tz='UTC'), 'phone': pa.string(), 'first_name': pa.string(),
+             'last_name': pa.string(), 'test': pa.string(), 'answers': pa.string()}
+    return pa.schema([(header, types.get(header, pa.int64())) for header in HEADERS])
+
+
+def record_batch(schema, chunk):
+    columns = zip(*chunk)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(column, type) for column, type in zip(columns, schema.types)], schema=schema
+    )
+
+
+def write_parquet(rows, path, chunk_size=CHUNK_SIZE):
+    """Write rows to a Parquet file, one row group per chunk; returns the row count"""
+    schema = parquet_schema()
+    written = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                writer.write_batch(record_batch(schema, chunk))
+                written += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write_batch(record_batch(schema, chunk))
+            written += len(chunk)
+    return written
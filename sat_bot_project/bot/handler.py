@@ -2,6 +2,18 @@ from telegram.ext import Application, CommandHandler, CallbackQueryHandler, Mess
 from django.conf import settings
 import logging
 from . import registerlogin, main
+from .cache import question_bank, user_profiles
+from .render import render_stats
+from .persistence import DjangoPersistence
+from .concurrency import ChatOrderedUpdateProcessor, chat_lock
+from .timers import ModuleTimers
+from .ratelimit import OutboundRateLimiter
+from . import metrics
+from .router import (
+    CallbackRouter, choice, REGISTER, LOGIN, LOGOUT, MAIN_MENU, START_TEST, MY_RESULTS,
+    RESULTS_PAGE, ANSWER, GO_TO_QUESTION, NEXT_QUESTION, PREV_QUESTION, FINISH_MODULE, START_MODULE2,
+)
+import functools
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -13,49 +25,35 @@ logger = logging.getLogger(__name__)
 from telegram import Update
 from telegram.ext import ContextTypes
 
+@metrics.instrumented
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
-    await registerlogin.show_auth_menu(update, context)
+    if await registerlogin.auto_login(update, context):
+        await main.show_main_menu(update, context, is_message=True)
+    else:
+        await registerlogin.show_auth_menu(update, context)
+
+# Callback routes: route code -> handler and argument converters
+router = CallbackRouter()
+router.add(REGISTER, registerlogin.handle_register)
+router.add(LOGIN, registerlogin.handle_login)
+router.add(LOGOUT, registerlogin.handle_logout)
+router.add(MAIN_MENU, main.show_main_menu)
+router.add(START_TEST, main.start_test, int)
+router.add(MY_RESULTS, main.show_my_results)
+router.add(RESULTS_PAGE, main.show_results_page, choice('older', 'newer'), int, int)
+router.add(ANSWER, main.answer_question, choice('A', 'B', 'C', 'D'), int, int)
+router.add(GO_TO_QUESTION, main.go_to_question, int, int)
+router.add(NEXT_QUESTION, main.next_question)
+router.add(PREV_QUESTION, main.prev_question)
+router.add(FINISH_MODULE, main.finish_module, int)
+router.add(START_MODULE2, main.start_module2)
 
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all callback queries"""
-    query = update.callback_query
-    data = query.data
-    
-    # Authentication callbacks
-    if data == 'register':
-        await registerlogin.handle_register(update, context)
-    elif data == 'login':
-        await registerlogin.handle_login(update, context)
-    elif data == 'logout':
-        await registerlogin.handle_logout(update, context)
-    
-    # Main menu callbacks
-    elif data == 'main_menu':
-        await main.show_main_menu(update, context)
-    elif data.startswith('test_'):
-        test_id = int(data.split('_')[1])
-        await main.start_test(update, context, test_id)
-    elif data == 'my_results':
-        await main.show_my_results(update, context)
-    
-    # Test navigation callbacks
-    elif data.startswith('answer_'):
-        answer = data.split('_')[1]
-        await main.answer_question(update, context, answer)
-    elif data == 'next_question':
-        await main.next_question(update, context)
-    elif data == 'prev_question':
-        await main.prev_question(update, context)
-    elif data == 'finish_module':
-        module = context.user_data.get('current_module', 1)
-        if module == 1:
-            await main.end_module(update, context)
-        else:
-            await main.end_test(update, context)
-    elif data == 'start_module2':
-        await main.start_module2(update, context)
+    await router.dispatch(update, context)
 
+@metrics.instrumented
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle text messages and contact sharing"""
     action = context.user_data.get('action')
@@ -81,17 +79,81 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'Please use the menu buttons or type /start to begin.'
             )
 
-def run():
-    """Main function to run the bot"""
-    # Get token from Django settings
-    token = settings.TELEGRAM_BOT_TOKEN
-    
-    if not token or token == 'YOUR_BOT_TOKEN_HERE':
-        logger.error("Please set TELEGRAM_BOT_TOKEN in settings.py")
-        return
-    
-    # Create application
-    application = Application.builder().token(token).build()
+@metrics.instrumented
+async def expire_module(application, user_id, chat_id, module):
+    """Grade and close a module whose time ran out, then notify the user"""
+    context = application.context_types.context(application, chat_id=chat_id, user_id=user_id)
+    context.user_data.setdefault('screen', (chat_id, None, False))
+    async with chat_lock(application, chat_id):
+        if module == 1:
+            await main.end_module(None, context, timed_out=True)
+        else:
+            await main.end_test(None, context, timed_out=True)
+    application.mark_data_for_update_persistence(user_ids=user_id)
+
+async def start_module_timers(application):
+    """Start the shared module timer and re-arm the deadlines of restored sessions"""
+    timers = ModuleTimers(functools.partial(expire_module, application))
+    application.bot_data['module_timers'] = timers
+    restored = main.restore_module_timers(application, timers)
+    timers.start()
+    logger.info('Module timers running, %d restored', restored)
+
+async def start_services(application):
+    """Start the module timers and, when BOT_METRICS_PORT is set, the metrics server"""
+    await start_module_timers(application)
+    if settings.BOT_METRICS_PORT:
+        application.bot_data['metrics_server'] = await metrics.serve_metrics(
+            settings.BOT_METRICS_HOST, settings.BOT_METRICS_PORT
+        )
+
+async def stop_module_timers(application):
+    """Stop the shared module timer"""
+    timers = application.bot_data.pop('module_timers', None)
+    if timers is not None:
+        await timers.stop()
+
+async def stop_services(application):
+    """Stop what start_services started"""
+    await stop_module_timers(application)
+    server = application.bot_data.pop('metrics_server', None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+
+def build_application(update_queue=None, token=None, base_url=None):
+    """Create the Application with all handlers registered.
+
+    Polling uses the default updater; webhook mode passes its own bounded
+    update_queue and runs without an updater. base_url points the bot at
+    another Bot API server, such as the load test's stand-in.
+    """
+    # Create application; in-progress tests survive restarts through the database
+    persistence = DjangoPersistence(update_interval=settings.BOT_PERSISTENCE_INTERVAL)
+    builder = (
+        Application.builder()
+        .token(token or settings.TELEGRAM_BOT_TOKEN)
+        .persistence(persistence)
+        # Different chats run in parallel, each chat's updates stay in order
+        .concurrent_updates(ChatOrderedUpdateProcessor(settings.BOT_CONCURRENT_UPDATES))
+        # Stay under Telegram's flood limits, answering taps before new messages
+        .rate_limiter(OutboundRateLimiter(
+            overall_rate=settings.BOT_RATE_OVERALL,
+            overall_burst=settings.BOT_RATE_OVERALL,
+            chat_rate=settings.BOT_RATE_PER_CHAT,
+            chat_burst=settings.BOT_RATE_CHAT_BURST,
+        ))
+        # Time every Bot API call for the metrics
+        .request(metrics.InstrumentedRequest(connection_pool_size=256))
+        .post_init(start_services)
+        .post_stop(stop_services)
+    )
+    if update_queue is not None:
+        builder = builder.update_queue(update_queue).updater(None)
+    if base_url is not None:
+        builder = builder.base_url(base_url).base_file_url(base_url.replace('/bot', '/file/bot', 1))
+    application = builder.build()
+    metrics.watch(application)
     
     # Add handlers - ORDER MATTERS!
     application.add_handler(CommandHandler('start', start_command))
@@ -103,9 +165,31 @@ def run():
     # Text handler
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, message_handler))
     
+    return application
+
+def log_stats(application):
+    """Log cache, rendering and rate limiter statistics"""
+    logger.info('Question cache stats: %s', question_bank.stats())
+    logger.info('User cache stats: %s', user_profiles.stats())
+    for route, stats in router.stats().items():
+        logger.info('Callback route %s: %s', route, stats)
+    if isinstance(application.bot.rate_limiter, OutboundRateLimiter):
+        logger.info('Rate limiter stats: %s', application.bot.rate_limiter.stats())
+    for flow, stats in render_stats().items():
+        logger.info('Render flow %s: %s', flow, stats)
+
+def run():
+    """Main function to run the bot"""
+    # Get token from Django settings
+    token = settings.TELEGRAM_BOT_TOKEN
+    
+    if not token or token == 'YOUR_BOT_TOKEN_HERE':
+        logger.error("Please set TELEGRAM_BOT_TOKEN in settings.py")
+        return
+    
+    application = build_application()
+    
     # Start the bot
     logger.info('Bot is running...')
     application.run_polling(allowed_updates=Update.ALL_TYPES)
-
-
-
+    log_stats(application)
@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+import io
+import logging
+import multiprocessing
+import os
+import threading
+
+from .cache import invalidate_test
+from .models import Question
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def optimize_image(path, max_side, quality):
+    """Downscale and recompress an image file to a metadata-free JPEG.
+
+    Runs in a worker process; returns (original bytes, optimized JPEG bytes).
+    """
+    with Image.open(path) as image:
+        # Apply the EXIF rotation before the metadata is dropped
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+    return os.path.getsize(path), output.getvalue()
+
+
+def pool():
+    """The process pool shared by image optimizations, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_OPTIMIZER_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def optimized_name(instance):
+    """Storage name of the optimized derivative of an instance's image"""
+    field = instance._meta.get_field('image_optimized')
+    stem = os.path.splitext(os.path.basename(instance.image.name))[0]
+    return field.generate_filename(instance, f'{stem}.jpg')
+
+
+def store_optimized(model, pk, source, optimized):
+    """Save the derivative and point the row at it, unless the image changed meanwhile"""
+    name = default_storage.save(optimized_name(model(pk=pk, image=source)), ContentFile(optimized))
+    close_old_connections()
+    rows = model.objects.filter(pk=pk, image=source)
+    if model is Question:
+        # The file_id Telegram gave so far is of the original upload
+        test_id = rows.values_list('test_id', flat=True).first()
+        updated = rows.update(image_optimized=name, image_file_id='')
+    else:
+        test_id = pk
+        updated = rows.update(image_optimized=name)
+    if not updated:
+        default_storage.delete(name)
+        return None
+    # Cached modules still hold the row without the derivative
+    invalidate_test(test_id)
+    return name
+
+
+def submit(instance):
+    """Start optimizing an instance's image in the pool; returns the future"""
+    future = pool().submit(
+        optimize_image,
+        instance.image.path,
+        settings.IMAGE_MAX_SIDE,
+        settings.IMAGE_JPEG_QUALITY,
+    )
+    future.instance_key = (type(instance), instance.pk, instance.image.name)
+    return future
+
+
+def finish(future):
+    """Store a finished optimization and log the bytes it saved.
+
+    Returns (image name, original bytes, optimized bytes), or None if it
+    failed; the derivative is only kept when it is smaller than the original.
+    """
+    model, pk, source = future.instance_key
+    try:
+        original, optimized = future.result()
+        if len(optimized) >= original:
+            logger.info('Kept %s as uploaded: %d bytes, optimized %d', source, original, len(optimized))
+            return source, original, original
+        if store_optimized(model, pk, source, optimized):
+            logger.info('Optimized %s: %d -> %d bytes (%d saved)',
+                        source, original, len(optimized), original - len(optimized))
+        return source, original, len(optimized)
+    except Exception:
+        logger.exception('Could not optimize %s', source)
+        return None
+
+
+def schedule_optimization(instance):
+    """Optimize an instance's image in the background once the transaction commits"""
+    def start():
+        submit(instance).add_done_callback(finish)
+
+    transaction.on_commit(start)
@@ -0,0 +1,201 @@
+from collections import namedtuple
+from django.core.files.storage import default_storage
+from django.db import transaction
+import csv
+import json
+import os
+import zipfile
+
+from .images import schedule_optimization
+from .models import Test, Question
+
+QUESTIONS_PER_MODULE = 27
+COLUMNS = ('test', 'module', 'question_number', 'question_text',
+           'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer')
+
+ImportedTest = namedtuple('ImportedTest', ['test_id', 'name', 'questions', 'is_complete'])
+
+
+class QuestionImportError(Exception):
+    """A test in the file is invalid; nothing of it was saved"""
+
+    def __init__(self, test_name, messages):
+        self.test_name = test_name
+        self.messages = messages
+        super().__init__(f'{test_name}: ' + '; '.join(messages))
+
+
+def text_lines(fileobj, filename):
+    """Yield the lines of a UTF-8 file, naming the first line that isn't UTF-8"""
+    for line, raw in enumerate(fileobj, 1):
+        try:
+            yield raw.decode('utf-8-sig' if line == 1 else 'utf-8')
+        except UnicodeDecodeError:
+            raise QuestionImportError(filename, [f'line {line}: not UTF-8 text'])
+
+
+def read_rows(fileobj, filename):
+    """Yield (line, row dict) from a CSV or JSONL file without loading it whole"""
+    lines = text_lines(fileobj, filename)
+    if filename.lower().endswith('.jsonl'):
+        for line, raw in enumerate(lines, 1):
+            if not raw.strip():
+                continue
+            try:
+                row = json.loads(raw)
+            except json.JSONDecodeError as error:
+                raise QuestionImportError(filename, [f'line {line}: invalid JSON ({error.msg})'])
+            if not isinstance(row, dict):
+                raise QuestionImportError(filename, [f'line {line}: expected a JSON object'])
+            yield line, row
+    elif filename.lower().endswith('.csv'):
+        reader = csv.DictReader(lines)
+        missing = set(COLUMNS) - set(reader.fieldnames or ())
+        if missing:
+            raise QuestionImportError(filename, [f'missing columns: {", ".join(sorted(missing))}'])
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        raise QuestionImportError(filename, ['expected a .csv, .jsonl or .zip file'])
+
+
+def group_by_test(rows):
+    """Yield (test name, rows) for each run of rows of one test.
+
+    The rows of a test must be contiguous, so only one test is held in
+    memory at a time.
+    """
+    seen = set()
+    name, group = None, []
+    for line, row in rows:
+        row_test = str(row.get('test', '')).strip()
+        if row_test != name:
+            if group:
+                yield name, group
+            if row_test in seen:
+                raise QuestionImportError(row_test, [f'line {line}: the rows of a test must be contiguous'])
+            seen.add(row_test)
+            name, group = row_test, []
+        group.append((line, row))
+    if group:
+        yield name, group
+
+
+def build_questions(name, rows, images):
+    """Validate one test's rows in memory and return unsaved Questions, or raise"""
+    errors = []
+    if not name:
+        errors.append(f'line {rows[0][0]}: test name is empty')
+    if len(rows) > 2 * QUESTIONS_PER_MODULE:
+        errors.append(f'{len(rows)} questions, at most {2 * QUESTIONS_PER_MODULE} allowed')
+        raise QuestionImportError(name, errors)
+
+    questions, numbers = [], set()
+    for line, row in rows:
+        row_errors = len(errors)
+        try:
+            module = int(row['module'])
+            number = int(row['question_number'])
+        except (KeyError, TypeError, ValueError):
+            errors.append(f'line {line}: module and question_number must be numbers')
+            continue
+        if module not in (1, 2):
+            errors.append(f'line {line}: module must be 1 or 2')
+        if not 1 <= number <= QUESTIONS_PER_MODULE:
+            errors.append(f'line {line}: Module {module} questions must be numbered 1-{QUESTIONS_PER_MODULE}')
+        if (module, number) in numbers:
+            errors.append(f'line {line}: Module {module} Q{number} appears twice')
+        numbers.add((module, number))
+        answer = str(row.get('correct_answer', '')).strip().upper()
+        if answer not in ('A', 'B', 'C', 'D'):
+            errors.append(f'line {line}: correct_answer must be A, B, C or D')
+        text = {column: str(row.get(column) or '') for column in COLUMNS[3:8]}
+        blank = [column for column, value in text.items() if not value.strip()]
+        if blank:
+            errors.append(f'line {line}: {", ".join(blank)} must not be empty')
+        image = str(row.get('image') or '').strip()
+        if image and image not in images:
+            errors.append(f'line {line}: image {image} is not in the archive')
+        if len(errors) > row_errors:
+            continue
+        questions.append(Question(
+            module=module,
+            question_number=number,
+            correct_answer=answer,
+            image=image,
+            **text,
+        ))
+
+    if errors:
+        raise QuestionImportError(name, errors)
+    return questions
+
+
+def save_images(questions, archive):
+    """Copy each question's image out of the archive into media storage"""
+    field = Question._meta.get_field('image')
+    saved = []
+    for question in questions:
+        if question.image:
+            with archive.open(question.image.name) as image:
+                name = field.generate_filename(question, os.path.basename(question.image.name))
+                question.image = default_storage.save(name, image)
+                saved.append(question.image.name)
+    return saved
+
+
+def save_test(name, description, questions, archive=None):
+    """Create a test with all its questions in one transaction"""
+    saved_images = save_images(questions, archive) if archive is not None else []
+    try:
+        with transaction.atomic():
+            test = Test.objects.create(name=name, description=description)
+            for question in questions:
+                question.test = test
+            Question.objects.bulk_create(questions)
+            is_complete = all(
+                sum(question.module == module for question in questions) == QUESTIONS_PER_MODULE
+                for module in (1, 2)
+            )
+            Test.objects.filter(pk=test.pk).update(is_complete=is_complete)
+            for question in questions:
+                if question.image:
+                    schedule_optimization(question)
+    except Exception:
+        for image in saved_images:
+            default_storage.delete(image)
+        raise
+    return ImportedTest(test.pk, name, len(questions), is_complete)
+
+
+def import_tests(fileobj, filename):
+    """Import every test in a CSV, JSONL or ZIP file, one transaction per test.
+
+    A ZIP holds one .csv or .jsonl file and the images its `image` column
+    names. Yields an ImportedTest, or a QuestionImportError for a test that
+    was skipped, per test in file order.
+    """
+    archive = None
+    images = set()
+    if filename.lower().endswith('.zip'):
+        archive = zipfile.ZipFile(fileobj)
+        members = [info.filename for info in archive.infolist() if not info.is_dir()]
+        sheets = [member for member in members if member.lower().endswith(('.csv', '.jsonl'))]
+        if len(sheets) != 1:
+            raise QuestionImportError(filename, ['the archive must hold exactly one .csv or .jsonl file'])
+        images = set(members) - set(sheets)
+        filename = sheets[0]
+        fileobj = archive.open(filename)
+
+    try:
+        for name, rows in group_by_test(read_rows(fileobj, filename)):
+            try:
+                questions = build_questions(name, rows, images)
+            except QuestionImportError as error:
+                yield error
+                continue
+            description = str(rows[0][1].get('description') or '')
+            yield save_test(name, description, questions, archive)
+    finally:
+        if archive is not None:
+            archive.close()
@@ -1,11 +1,24 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import MessageLimit
 from telegram.ext import ContextTypes
-from datetime import datetime, timedelta
-from .models import Test, Question, TestResult, User
-import asyncio
-from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Max, OuterRef, Q, Subquery
+from .models import Test, Question, TestResult, ScoreBucket
+from .cache import get_module_bank, get_module_questions
+from .render import SELECTIONS, render, screen_of
+from .concurrency import schedule_followup
+from .session import TestSession, get_session
+from .router import (
+    encode, START_TEST, MY_RESULTS, LOGOUT, MAIN_MENU, RESULTS_PAGE, START_MODULE2,
+)
+from .db import database_sync_to_async
+from datetime import datetime, timedelta, timezone
+import operator
+import time
 
 MODULE_TIME_LIMIT = 27 * 60  # 27 minutes in seconds
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
 def calculate_score(m1_correct, m1_total, m2_correct, m2_total):
     """Calculate estimated SAT score"""
@@ -15,22 +28,81 @@ def calculate_score(m1_correct, m1_total, m2_correct, m2_total):
     estimated_score = int(200 + (percentage / 100) * 600)
     return estimated_score
 
+def grade(answer_key, answers):
+    """Count matches between a module's answer key and an equally ordered answers buffer"""
+    return sum(map(operator.eq, answer_key, answers))
+
+@database_sync_to_async
+def save_file_id(question_id, image_name, file_id):
+    """Store the Telegram file_id unless the image was replaced meanwhile"""
+    Question.objects.filter(pk=question_id, image=image_name).update(image_file_id=file_id)
+
+async def remember_file_id(question, file_id):
+    """Reuse the uploaded photo by file_id on the next render"""
+    question.image_file_id = file_id
+    await save_file_id(question.pk, question.image.name, file_id)
+
+def current_screen(update, context):
+    """The message to replace: the one tapped, else the last one the bot rendered"""
+    if update and update.callback_query:
+        return screen_of(update.callback_query.message)
+    return context.user_data['screen']
+
+async def show(context, screen, text, reply_markup=None, flow='other', **kwargs):
+    """Render a screen and remember it for server-side updates such as timeouts"""
+    message = await render(context.bot, screen, text, reply_markup, flow=flow, **kwargs)
+    if message:
+        context.user_data['screen'] = screen_of(message)
+    return message
+
+def module_in_progress(context, module):
+    """Whether the user's module is still running"""
+    session = get_session(context.user_data)
+    return session is not None and session.in_progress(module)
+
+def start_module_timer(update, context, session):
+    """Close the session's module on the server when its time limit is reached"""
+    session.deadline = session.module_start(session.module) + MODULE_TIME_LIMIT
+    timers = context.bot_data.get('module_timers')
+    if timers is not None:
+        timers.schedule(update.effective_user.id, update.effective_chat.id, session.module, session.deadline)
+
+def stop_module_timer(update, context, session):
+    """Forget the running module's deadline"""
+    session.deadline = None
+    timers = context.bot_data.get('module_timers')
+    if timers is not None and update is not None:
+        timers.cancel(update.effective_user.id)
+
+def restore_module_timers(application, timers):
+    """Schedule the deadlines of every module still running, e.g. after a restart"""
+    for user_id, user_data in application.user_data.items():
+        session = get_session(user_data)
+        if session is not None and session.deadline is not None:
+            chat_id = user_data['screen'][0] if user_data.get('screen') else user_id
+            timers.schedule(user_id, chat_id, session.module, session.deadline)
+    return len(timers)
+
+def available_tests():
+    """Tests students can take, newest first"""
+    return Test.objects.filter(is_complete=True, is_active=True).order_by('-created_date')
+
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, is_message=False):
     """Show main menu with test selection"""
     user = context.user_data.get('user')
     
     # Get all complete and active tests
-    tests = await sync_to_async(list)(Test.objects.filter(is_complete=True, is_active=True).order_by('-created_date'))
+    tests = await database_sync_to_async(list)(available_tests())
     
     keyboard = []
     for test in tests:
         keyboard.append([InlineKeyboardButton(
             f"📚 {test.name}", 
-            callback_data=f'test_{test.id}'
+            callback_data=encode(START_TEST, test.id)
         )])
     
-    keyboard.append([InlineKeyboardButton("📊 My Results", callback_data='my_results')])
-    keyboard.append([InlineKeyboardButton("🚪 Logout", callback_data='logout')])
+    keyboard.append([InlineKeyboardButton("📊 My Results", callback_data=encode(MY_RESULTS))])
+    keyboard.append([InlineKeyboardButton("🚪 Logout", callback_data=encode(LOGOUT))])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -51,42 +123,38 @@ async def start_test(update: Update, context: ContextTypes.DEFAULT_TYPE, test_id
     await query.answer()
     
     try:
-        test = await sync_to_async(Test.objects.get)(id=test_id, is_complete=True, is_active=True)
+        test = await database_sync_to_async(Test.objects.get)(id=test_id, is_complete=True, is_active=True)
     except Test.DoesNotExist:
         await query.edit_message_text('❌ Test not found or not available.')
         return
     
-    context.user_data['test_id'] = test_id
-    context.user_data['test_name'] = test.name
-    context.user_data['current_module'] = 1
-    context.user_data['current_question'] = 0
-    context.user_data['answers'] = {}
-    context.user_data['module1_start'] = datetime.now()
+    session = context.user_data['session'] = TestSession(test_id, test.name)
+    start_module_timer(update, context, session)
     
-    await query.edit_message_text(
+    message = await query.edit_message_text(
         f'📚 Starting: {test.name}\n\n'
         f'⏱ Module 1: 27 minutes\n'
         f'📝 27 questions\n\n'
         f'Get ready...'
     )
+    context.user_data['screen'] = screen_of(message)
     
-    await asyncio.sleep(2)
-    await show_question(update, context)
+    # Show the first question shortly, without holding up other updates
+    schedule_followup(context, update.effective_chat.id, 2, show_question, update, context, 'start', update=update)
 
-async def show_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Display current question"""
+async def show_question(update: Update, context: ContextTypes.DEFAULT_TYPE, flow='show'):
+    """Display current question; the caller has answered the callback query"""
     query = update.callback_query
-    await query.answer()
     
-    test_id = context.user_data['test_id']
-    module = context.user_data['current_module']
-    q_index = context.user_data['current_question']
+    session = get_session(context.user_data)
+    if session is None or not session.in_progress(session.module):
+        return
+    module = session.module
+    q_index = session.question
     
     # Get questions for current module
-    questions = await sync_to_async(list)(Question.objects.filter(
-        test_id=test_id, 
-        module=module
-    ).order_by('question_number'))
+    bank = await get_module_bank(session.test_id, module)
+    questions = bank.questions
     
     if q_index >= len(questions):
         if module == 1:
@@ -98,12 +166,7 @@ async def show_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     question = questions[q_index]
     
     # Calculate time remaining
-    if module == 1:
-        start_time = context.user_data['module1_start']
-    else:
-        start_time = context.user_data['module2_start']
-    
-    elapsed = (datetime.now() - start_time).total_seconds()
+    elapsed = time.time() - session.module_start(module)
     remaining = MODULE_TIME_LIMIT - elapsed
     
     if remaining <= 0:
@@ -116,209 +179,322 @@ async def show_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     minutes_remaining = int(remaining // 60)
     seconds_remaining = int(remaining % 60)
     
-    # Get current answer
-    answer_key = f'module{module}_q{q_index}'
-    current_answer = context.user_data['answers'].get(answer_key)
-    
-    # Build question text
-    text = f'⏱ Module {module} - Time: {minutes_remaining}:{seconds_remaining:02d}\n\n'
-    text += f'Question {q_index + 1}/{len(questions)}\n\n'
-    text += f'{question.question_text}\n\n'
-    
-    # Add options to the message text
-    text += 'Options:\n'
-    for option_letter in ['A', 'B', 'C', 'D']:
-        option_text = getattr(question, f'option_{option_letter.lower()}')
-        prefix = '✅ ' if current_answer == option_letter else ''
-        text += f'{prefix}{option_letter}) {option_text}\n'
-    text += '\n'
-    
-    # Build keyboard with options
-    keyboard = []
-    for option_letter in ['A', 'B', 'C', 'D']:
-        prefix = '✅ ' if current_answer == option_letter else ''
-        keyboard.append([InlineKeyboardButton(
-            f'{prefix}{option_letter}',
-            callback_data=f'answer_{option_letter}'
-        )])
-    
-    # Navigation buttons
-    nav_buttons = []
-    if q_index > 0:
-        nav_buttons.append(InlineKeyboardButton('⬅️ Previous', callback_data='prev_question'))
-    if q_index < len(questions) - 1:
-        nav_buttons.append(InlineKeyboardButton('Next ➡️', callback_data='next_question'))
+    # The question and keyboard for the current answer are pre-rendered; only the timer changes
+    body, reply_markup = bank.screens[q_index][SELECTIONS.index(session.answer(module, q_index))]
+    text = f'⏱ Module {module} - Time: {minutes_remaining}:{seconds_remaining:02d}\n\n' + body
+    
+    screen = screen_of(query.message)
+    keep_photo = flow == 'answer' and bool(question.image) and screen[2]
+    if question.image and not question.image_file_id and not keep_photo:
+        image = question.image_optimized or question.image
+        with open(image.path, 'rb') as photo_file:
+            message = await show(context, screen, text, reply_markup, photo=photo_file, flow=flow)
+        if message and message.photo:
+            await remember_file_id(question, message.photo[-1].file_id)
     else:
-        nav_buttons.append(InlineKeyboardButton('✅ Finish Module', callback_data='finish_module'))
-    
-    if nav_buttons:
-        keyboard.append(nav_buttons)
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await query.delete_message()
-    
-    if question.image:
-        with open(question.image.path, 'rb') as photo_file:
-            await context.bot.send_photo(
-                chat_id=query.message.chat_id,
-                photo=photo_file,
-                caption=text,
-                reply_markup=reply_markup
-            )
-    else:
-        await context.bot.send_message(
-            chat_id=query.message.chat_id,
-            text=text,
-            reply_markup=reply_markup
-        )
+        photo = question.image_file_id if question.image else None
+        await show(context, screen, text, reply_markup, photo=photo, keep_photo=keep_photo, flow=flow)
 
-async def answer_question(update: Update, context: ContextTypes.DEFAULT_TYPE, answer: str):
-    """Record answer and refresh question display"""
-    module = context.user_data['current_module']
-    q_index = context.user_data['current_question']
-    answer_key = f'module{module}_q{q_index}'
+async def answer_question(update: Update, context: ContextTypes.DEFAULT_TYPE, answer: str, module=None, index=None):
+    """Record answer and refresh question display.
+
+    Buttons carry the module and question they were shown for, so a tap on an
+    older message answers that question; buttons without them answer the
+    current one.
+    """
+    await update.callback_query.answer()
+    session = get_session(context.user_data)
+    if session is None or not session.in_progress(session.module) or module not in (None, session.module):
+        return
     
-    context.user_data['answers'][answer_key] = answer
-    await show_question(update, context)
+    if index is not None:
+        if not 0 <= index < len(await get_module_questions(session.test_id, session.module)):
+            return
+        session.question = index
+    session.set_answer(session.module, session.question, answer)
+    await show_question(update, context, flow='answer')
 
-async def next_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Move to next question"""
+async def go_to_question(update: Update, context: ContextTypes.DEFAULT_TYPE, module, index):
+    """Show a question of the running module"""
     query = update.callback_query
     await query.answer()
     
-    test_id = context.user_data['test_id']
-    module = context.user_data['current_module']
+    session = get_session(context.user_data)
+    if session is None or not session.in_progress(module):
+        return
     
-    questions_count = await sync_to_async(Question.objects.filter(test_id=test_id, module=module).count)()
+    questions_count = len(await get_module_questions(session.test_id, module))
     
-    if context.user_data['current_question'] < questions_count - 1:
-        context.user_data['current_question'] += 1
-        await show_question(update, context)
+    if 0 <= index < questions_count and index != session.question:
+        flow = 'next' if index > session.question else 'prev'
+        session.question = index
+        await show_question(update, context, flow=flow)
+
+async def next_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Move to next question"""
+    session = get_session(context.user_data)
+    if session is None:
+        await update.callback_query.answer()
+        return
+    await go_to_question(update, context, session.module, session.question + 1)
 
 async def prev_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Move to previous question"""
-    query = update.callback_query
-    await query.answer()
-    
-    if context.user_data['current_question'] > 0:
-        context.user_data['current_question'] -= 1
-        await show_question(update, context)
+    session = get_session(context.user_data)
+    if session is None:
+        await update.callback_query.answer()
+        return
+    await go_to_question(update, context, session.module, session.question - 1)
 
-async def end_module(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """End current module and show results"""
-    query = update.callback_query
-    await query.answer()
-    
-    test_id = context.user_data['test_id']
+async def finish_module(update: Update, context: ContextTypes.DEFAULT_TYPE, module=None):
+    """Finish the module the button was shown for (the running one for older buttons)"""
+    await update.callback_query.answer()
+    if module is None:
+        session = get_session(context.user_data)
+        module = session.module if session is not None else 1
+    if module == 1:
+        await end_module(update, context)
+    else:
+        await end_test(update, context)
+
+async def end_module(update: Update, context: ContextTypes.DEFAULT_TYPE, timed_out=False):
+    """End current module and show results.
+
+    Called without an update when the module timer expires on the server,
+    otherwise after the callback query was answered.
+    """
+    if not module_in_progress(context, 1):
+        return
+    session = get_session(context.user_data)
+    stop_module_timer(update, context, session)
     
     # Calculate Module 1 results
-    m1_total = await sync_to_async(Question.objects.filter(test_id=test_id, module=1).count)()
-    questions = await sync_to_async(list)(Question.objects.filter(test_id=test_id, module=1).order_by('question_number'))
-    
-    m1_correct = 0
-    
-    for i, question in enumerate(questions):
-        answer_key = f'module1_q{i}'
-        user_answer = context.user_data['answers'].get(answer_key)
-        if user_answer == question.correct_answer:
-            m1_correct += 1
+    bank = await get_module_bank(session.test_id, 1)
+    m1_total = len(bank.answer_key)
+    m1_correct = grade(bank.answer_key, session.answers1)
     
     # Calculate time taken
-    elapsed = (datetime.now() - context.user_data['module1_start']).total_seconds()
-    context.user_data['module1_time'] = int(elapsed)
-    context.user_data['module1_results'] = (m1_correct, m1_total)
-    
-    await query.edit_message_text(
+    elapsed = time.time() - session.module1_start
+    session.module1_time = int(elapsed)
+    session.module1_correct = m1_correct
+    session.module1_total = m1_total
+    
+    screen = current_screen(update, context)
+    await show(
+        context,
+        screen,
+        ('⏰ Time is up!\n\n' if timed_out else '') +
         f'✅ Module 1 Complete!\n\n'
         f'Results: {m1_correct}/{m1_total}\n'
         f'Time: {int(elapsed // 60)} minutes {int(elapsed % 60)} seconds\n\n'
-        f'Get ready for Module 2...'
+        f'Get ready for Module 2...',
+        flow='end_module'
     )
     
-    await asyncio.sleep(3)
-    
     # Start Module 2
-    context.user_data['current_module'] = 2
-    context.user_data['current_question'] = 0
+    session.module = 2
+    session.question = 0
     
-    keyboard = [[InlineKeyboardButton('Start Module 2 ▶️', callback_data='start_module2')]]
+    schedule_followup(context, screen[0], 3, show_module2_intro, context, update=update)
+
+async def show_module2_intro(context: ContextTypes.DEFAULT_TYPE):
+    """Ask the user to start Module 2"""
+    keyboard = [[InlineKeyboardButton('Start Module 2 ▶️', callback_data=encode(START_MODULE2))]]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    await query.edit_message_text(
+    await show(
+        context,
+        context.user_data['screen'],
         f'🔄 Module 2\n\n'
         f'⏱ Time: 27 minutes\n'
         f'📝 Questions: 27\n\n'
         f'Ready?',
-        reply_markup=reply_markup
+        reply_markup,
+        flow='end_module'
     )
 
 async def start_module2(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start Module 2"""
-    context.user_data['module2_start'] = datetime.now()
-    await show_question(update, context)
+    await update.callback_query.answer()
+    session = get_session(context.user_data)
+    if session is None or session.module != 2 or session.module2_start is not None:
+        return
+    
+    session.module2_start = int(time.time())
+    start_module_timer(update, context, session)
+    await show_question(update, context, flow='start')
 
-async def end_test(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """End test and save results"""
-    query = update.callback_query
-    await query.answer()
+@database_sync_to_async
+def save_result(**fields):
+    """Save a finished test, counted in its score histogram in the same transaction; returns its standing"""
+    with transaction.atomic():
+        result = TestResult.objects.create(**fields)
+    return ScoreBucket.standing(result.test_id, result.estimated_score)
+
+def standing_text(standing):
+    """How a result compares with the test's other results, if there are any"""
+    others = standing['total'] - 1
+    if others < 1:
+        return ''
+    better_than = round(100 * standing['below'] / others)
+    rank = standing['total'] - standing['below'] - standing['same'] + 1
+    return (
+        f'🏅 You scored better than {better_than}% of students on this test '
+        f'(rank {rank} of {standing["total"]})\n\n'
+    )
+
+async def end_test(update: Update, context: ContextTypes.DEFAULT_TYPE, timed_out=False):
+    """End test and save results.
+
+    Called without an update when the module timer expires on the server,
+    otherwise after the callback query was answered.
+    """
+    if not module_in_progress(context, 2):
+        return
+    session = get_session(context.user_data)
+    stop_module_timer(update, context, session)
     
-    test_id = context.user_data['test_id']
+    test_id = session.test_id
     phone = context.user_data['user']['phone']
     
     # Calculate Module 2 results
-    m2_total = await sync_to_async(Question.objects.filter(test_id=test_id, module=2).count)()
-    questions = await sync_to_async(list)(Question.objects.filter(test_id=test_id, module=2).order_by('question_number'))
-    m2_correct = 0
-    
-    for i, question in enumerate(questions):
-        answer_key = f'module2_q{i}'
-        user_answer = context.user_data['answers'].get(answer_key)
-        if user_answer == question.correct_answer:
-            m2_correct += 1
+    bank = await get_module_bank(test_id, 2)
+    m2_total = len(bank.answer_key)
+    m2_correct = grade(bank.answer_key, session.answers2)
     
     # Calculate time taken
-    elapsed = (datetime.now() - context.user_data['module2_start']).total_seconds()
+    elapsed = time.time() - session.module2_start
     m2_time = int(elapsed)
     
-    m1_correct, m1_total = context.user_data['module1_results']
-    m1_time = context.user_data['module1_time']
+    m1_correct, m1_total = session.module1_correct, session.module1_total
+    m1_time = session.module1_time
     
     estimated_score = calculate_score(m1_correct, m1_total, m2_correct, m2_total)
     
-    # Save results to database
-    user = await sync_to_async(User.objects.get)(phone=phone)
-    test = await sync_to_async(Test.objects.get)(id=test_id)
-    
-    await sync_to_async(TestResult.objects.create)(
-        user=user,
-        test=test,
+    # Save results to database (the phone is the user's primary key)
+    standing = await save_result(
+        user_id=phone,
+        test_id=test_id,
         module1_correct=m1_correct,
         module1_total=m1_total,
         module2_correct=m2_correct,
         module2_total=m2_total,
         estimated_score=estimated_score,
         module1_time_taken=m1_time,
-        module2_time_taken=m2_time
+        module2_time_taken=m2_time,
+        # One packed row per attempt for item analysis
+        answers=(session.answers1 + session.answers2).decode('ascii')
     )
     
     result_text = (
+        ('⏰ Time is up!\n\n' if timed_out else '') +
         f'🎉 Test Complete!\n\n'
         f'📊 Your Results:\n'
         f'━━━━━━━━━━━━━━\n'
         f'Module 1: {m1_correct}/{m1_total}\n'
         f'Module 2: {m2_correct}/{m2_total}\n'
         f'━━━━━━━━━━━━━━\n'
-        f'📈 Estimated Score: {estimated_score}/800\n\n'
+        f'📈 Estimated Score: {estimated_score}/800\n\n' +
+        standing_text(standing) +
         f'Great job! Keep practicing to improve your score. 💪'
     )
     
-    keyboard = [[InlineKeyboardButton('🏠 Main Menu', callback_data='main_menu')]]
+    keyboard = [[InlineKeyboardButton('🏠 Main Menu', callback_data=encode(MAIN_MENU))]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    await query.edit_message_text(result_text, reply_markup=reply_markup)
+    await show(context, current_screen(update, context), result_text, reply_markup, flow='end_test')
+
+def results_cursor(result):
+    """Keyset position of a result: (test_date in epoch microseconds, id)"""
+    return (result.test_date - EPOCH) // timedelta(microseconds=1), result.id
+
+def load_results_page(phone, direction=None, cursor=None, page_size=None):
+    """One page of a user's results, newest first, seeked from a cursor instead of offset.
+
+    direction is 'older' (the page after cursor) or 'newer' (the page before
+    it). Returns (results, has_newer, has_older); a cursor with nothing
+    beyond it any more, e.g. after results were deleted, gives the first page.
+    """
+    page_size = page_size or settings.RESULTS_PAGE_SIZE
+    results = TestResult.objects.filter(user_id=phone).select_related('test')
+    if cursor is None:
+        page = list(results.order_by('-test_date', '-id')[:page_size + 1])
+        return page[:page_size], False, len(page) > page_size
+    
+    micros, result_id = cursor
+    test_date = EPOCH + timedelta(microseconds=micros)
+    if direction == 'older':
+        page = list(results.filter(
+            Q(test_date__lt=test_date) | Q(test_date=test_date, id__lt=result_id)
+        ).order_by('-test_date', '-id')[:page_size + 1])
+        if page:
+            return page[:page_size], True, len(page) > page_size
+    else:
+        page = list(results.filter(
+            Q(test_date__gt=test_date) | Q(test_date=test_date, id__gt=result_id)
+        ).order_by('test_date', 'id')[:page_size + 1])
+        if page:
+            return page[:page_size][::-1], len(page) > page_size, True
+    return load_results_page(phone, page_size=page_size)
+
+def load_results_summary(phone):
+    """Best, average and last score with the number of attempts per test, aggregated by the database.
+
+    Tests are ordered by their latest attempt, newest first.
+
+    Each figure is a subquery over the user's results of one test, so every
+    one of them is a seek on the (user, test, -test_date) index.
+    """
+    results = TestResult.objects.filter(user_id=phone, test_id=OuterRef('pk'))
+    
+    def per_test(aggregate):
+        return Subquery(results.values('test_id').annotate(value=aggregate).values('value'))
+    
+    rows = Test.objects.filter(
+        pk__in=TestResult.objects.filter(user_id=phone).values('test_id')
+    ).annotate(
+        best=per_test(Max('estimated_score')),
+        average=per_test(Avg('estimated_score')),
+        attempts=per_test(Count('id')),
+        last=Subquery(results.order_by('-test_date', '-id').values('estimated_score')[:1]),
+        last_date=Subquery(results.order_by('-test_date', '-id').values('test_date')[:1]),
+    ).values('id', 'name', 'best', 'average', 'attempts', 'last', 'last_date').order_by('id')
+    # One row per test the user took, so sorting here spares the database a sort without an index
+    return sorted(rows, key=operator.itemgetter('last_date'), reverse=True)
+
+async def show_results_page(update: Update, context: ContextTypes.DEFAULT_TYPE, direction, micros, result_id):
+    """Show the page of results older or newer than the given one"""
+    await show_my_results(update, context, direction, (micros, result_id))
 
-async def show_my_results(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show user's test results"""
+def results_text(summary, results):
+    """The My Results message: the per-test summary above a page of results"""
+    # Format results
+    page = ''
+    for result in results:
+        page += f'{result.test.name}\n'
+        page += f'📅 Date: {result.test_date.strftime("%Y-%m-%d %H:%M")}\n'
+        page += f'📝 Module 1: {result.module1_correct}/{result.module1_total}\n'
+        page += f'📝 Module 2: {result.module2_correct}/{result.module2_total}\n'
+        page += f'📈 Score: {result.estimated_score}/800\n'
+        page += f'━━━━━━━━━━━━━━\n'
+
+    # Format summary, keeping the message within Telegram's length limit
+    lines = [
+        f'📚 {row["name"]} ({row["attempts"]} attempts)\n'
+        f'🏆 Best: {row["best"]} · 📈 Average: {row["average"]:.0f} · 🕒 Last: {row["last"]}\n'
+        for row in summary
+    ]
+    shown = lines[:settings.RESULTS_SUMMARY_TESTS]
+    while True:
+        hidden = len(lines) - len(shown)
+        more = f'… and {hidden} more tests\n' if hidden else ''
+        text = '📊 Your Test Results:\n\n' + ''.join(shown) + more + '━━━━━━━━━━━━━━\n' + page
+        if len(text) <= MessageLimit.MAX_TEXT_LENGTH or not shown:
+            break
+        shown.pop()
+    return text
+
+async def show_my_results(update: Update, context: ContextTypes.DEFAULT_TYPE, direction=None, cursor=None):
+    """Show a page of the user's test results under a per-test summary"""
     query = update.callback_query
     await query.answer()
     
@@ -327,26 +503,30 @@ async def show_my_results(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text('❌ Please log in first.')
         return
     
-    # Get user's results
-    results = await sync_to_async(list)(TestResult.objects.filter(user__phone=user['phone']).select_related('test').order_by('-test_date'))
+    # Get one page of the user's results
+    results, has_newer, has_older = await database_sync_to_async(load_results_page)(user['phone'], direction, cursor)
     
     if not results:
         text = '📊 You haven\'t taken any tests yet.\n\nChoose a test from the main menu to get started!'
-        keyboard = [[InlineKeyboardButton('🏠 Main Menu', callback_data='main_menu')]]
+        keyboard = [[InlineKeyboardButton('🏠 Main Menu', callback_data=encode(MAIN_MENU))]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text(text, reply_markup=reply_markup)
         return
     
-    # Format results
-    text = '📊 Your Test Results:\n\n'
-    for i, result in enumerate(results, 1):
-        text += f'#{i} - {result.test.name}\n'
-        text += f'📅 Date: {result.test_date.strftime("%Y-%m-%d %H:%M")}\n'
-        text += f'📝 Module 1: {result.module1_correct}/{result.module1_total}\n'
-        text += f'📝 Module 2: {result.module2_correct}/{result.module2_total}\n'
-        text += f'📈 Score: {result.estimated_score}/800\n'
-        text += f'━━━━━━━━━━━━━━\n'
-    
-    keyboard = [[InlineKeyboardButton('🏠 Main Menu', callback_data='main_menu')]]
+    summary = await database_sync_to_async(load_results_summary)(user['phone'])
+    
+    text = results_text(summary, results)
+    
+    keyboard = []
+    nav_buttons = []
+    if has_newer:
+        micros, result_id = results_cursor(results[0])
+        nav_buttons.append(InlineKeyboardButton('⬅️ Newer', callback_data=encode(RESULTS_PAGE, 'newer', micros, result_id)))
+    if has_older:
+        micros, result_id = results_cursor(results[-1])
+        nav_buttons.append(InlineKeyboardButton('Older ➡️', callback_data=encode(RESULTS_PAGE, 'older', micros, result_id)))
+    if nav_buttons:
+        keyboard.append(nav_buttons)
+    keyboard.append([InlineKeyboardButton('🏠 Main Menu', callback_data=encode(MAIN_MENU))])
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(text, reply_markup=reply_markup)
@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, transaction
+from django.test.utils import override_settings
+import multiprocessing
+import threading
+import time
+
+from bot.cache import load_module_bank
+from bot.models import Test, Question
+
+# Pragmas of a SQLite database before the tuned profile
+ROLLBACK_JOURNAL = {'journal_mode': 'delete', 'synchronous': 'full'}
+
+
+def reader(test_id, stop, latencies, errors):
+    """Load a module's questions as the bot does on a cache miss, as fast as possible"""
+    try:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                load_module_bank(test_id, 1)
+            except OperationalError:
+                errors.append(time.perf_counter() - started)
+                continue
+            latencies.append(time.perf_counter() - started)
+    finally:
+        connection.close()
+
+
+def writer(test_id, stop, commits, errors):
+    """Save every question of a test in one transaction, as the admin's inline formset does.
+
+    Runs in its own process, like the admin next to the bot.
+    """
+    try:
+        while not stop.is_set():
+            try:
+                with transaction.atomic():
+                    for question in Question.objects.filter(test_id=test_id):
+                        question.save(update_fields=['question_text'])
+                with commits.get_lock():
+                    commits.value += 1
+            except OperationalError:
+                with errors.get_lock():
+                    errors.value += 1
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = 'Measure bot read latency while the admin writes, with and without the tuned SQLite profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('This benchmark compares SQLite journal modes')
+        profiles = (('rollback journal', ROLLBACK_JOURNAL), ('tuned (WAL)', settings.SQLITE_PRAGMAS))
+        for name, pragmas in profiles:
+            connection.close()
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                self.report(name, *self.run(options['readers'], options['seconds']))
+        connection.close()
+
+    def run(self, readers, seconds):
+        test = Test.objects.create(name='Contention benchmark')
+        Question.objects.bulk_create([
+            Question(test=test, module=module, question_number=number, question_text='?',
+                     option_a='A', option_b='B', option_c='C', option_d='D', correct_answer='A')
+            for module in (1, 2)
+            for number in range(1, 28)
+        ])
+        connection.close()
+
+        context = multiprocessing.get_context('fork')
+        stop = context.Event()
+        commits, write_errors = context.Value('i', 0), context.Value('i', 0)
+        admin = context.Process(target=writer, args=(test.pk, stop, commits, write_errors))
+        admin.start()
+
+        latencies, read_errors = [], []
+        threads = [threading.Thread(target=reader, args=(test.pk, stop, latencies, read_errors))
+                   for _ in range(readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        admin.join()
+
+        test.delete()
+        return seconds, latencies, read_errors, commits.value, write_errors.value
+
+    def report(self, name, seconds, latencies, read_errors, commits, write_errors):
+        latencies.sort()
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+        self.stdout.write(
+            f'{name:<17} reads {len(latencies) / seconds:>7.0f}/s'
+            f'  p50 {percentile(0.5):>6.1f} ms  p99 {percentile(0.99):>7.1f} ms'
+            f'  max {(latencies[-1] * 1000 if latencies else 0):>7.1f} ms'
+            f'  read errors {len(read_errors):>4}'
+            f'  admin saves {commits / seconds:>5.1f}/s  write errors {write_errors}'
+        )
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from asgiref.sync import sync_to_async
+import asyncio
+import time
+
+from bot.db import database_sync_to_async, executor
+from bot.main import available_tests, load_results_page, load_results_summary
+from bot.models import TestResult
+
+
+def busiest_user():
+    """Phone of the user with the most results, whose screens are the heaviest to load"""
+    busiest = (
+        TestResult.objects.values('user_id').annotate(results=Count('id'))
+        .order_by('-results').values_list('user_id', flat=True).first()
+    )
+    return busiest or '+0'
+
+
+def handler_queries(phone):
+    """The ORM calls of the bot's heaviest taps: the test list and the My Results screen"""
+    def run():
+        list(available_tests())
+        load_results_summary(phone)
+        load_results_page(phone)
+    return run
+
+
+async def simulate(wrap, users, taps, phone):
+    """Run users concurrent students tapping taps times each; returns taps per second and tap latencies"""
+    query = wrap(handler_queries(phone))
+    latencies = []
+
+    async def student():
+        for _ in range(taps):
+            started = time.perf_counter()
+            await query()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(student() for _ in range(users)))
+    return users * taps / (time.perf_counter() - started), sorted(latencies)
+
+
+class Command(BaseCommand):
+    help = "Compare handler throughput of the bot's database pool with thread-sensitive sync_to_async"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, nargs='+', default=[1, 50, 500])
+        parser.add_argument('--taps', type=int, default=20, help='Handler calls per simulated user')
+
+    def handle(self, *args, **options):
+        phone = busiest_user()
+        modes = [
+            ('sync_to_async', sync_to_async),
+            (f'pool ({executor._max_workers} threads)', database_sync_to_async),
+        ]
+        self.stdout.write(f'Real ORM calls against the configured database, as user {phone}')
+        self.stdout.write(f"{'users':>6}  " + '  '.join(f'{name:>30}' for name, _ in modes))
+        for users in options['users']:
+            cells = []
+            for _, wrap in modes:
+                rate, latencies = asyncio.run(simulate(wrap, users, options['taps'], phone))
+                p95 = latencies[int(len(latencies) * 0.95)] * 1000
+                cells.append(f'{rate:>8.0f} tap/s, p95 {p95:>7.1f} ms')
+            self.stdout.write(f'{users:>6}  ' + '  '.join(f'{cell:>30}' for cell in cells))
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+import gc
+import random
+import time
+import tracemalloc
+
+from bot.models import Question
+from bot.render import SELECTIONS, question_screen, question_screens
+
+QUESTIONS_PER_MODULE = 27
+
+
+def sample_module(rng):
+    """Unsaved questions of one module with realistic text lengths"""
+    words = 'the author claims that evidence suggests a reader would most likely infer which choice'.split()
+
+    def sentence(length):
+        return ' '.join(rng.choice(words) for _ in range(length)).capitalize() + '.'
+
+    return tuple(
+        Question(
+            module=1, question_number=number, question_text=sentence(60),
+            option_a=sentence(8), option_b=sentence(8), option_c=sentence(8), option_d=sentence(8),
+            correct_answer=rng.choice('ABCD'),
+        )
+        for number in range(1, QUESTIONS_PER_MODULE + 1)
+    )
+
+
+def header():
+    return '⏱ Module 1 - Time: 12:34\n\n'
+
+
+class Command(BaseCommand):
+    help = 'Compare building a question screen on every tap with the pre-rendered screens of the module bank'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--taps', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        questions = sample_module(rng)
+        taps = [(rng.randrange(QUESTIONS_PER_MODULE), rng.choice(SELECTIONS)) for _ in range(options['taps'])]
+
+        gc.collect()
+        tracemalloc.start()
+        started = time.perf_counter()
+        screens = question_screens(questions, 1)
+        build_seconds = time.perf_counter() - started
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(f'Pre-rendering a module: {build_seconds * 1000:.1f} ms, {held / 1024:.0f} kB held')
+
+        started = time.perf_counter()
+        for index, selected in taps:
+            body, reply_markup = question_screen(questions[index], 1, index, QUESTIONS_PER_MODULE, selected)
+            text = header() + body
+        built = (time.perf_counter() - started) / len(taps)
+
+        started = time.perf_counter()
+        for index, selected in taps:
+            body, reply_markup = screens[index][SELECTIONS.index(selected)]
+            text = header() + body
+        cached = (time.perf_counter() - started) / len(taps)
+
+        self.stdout.write(f'Built per tap:  {built * 1e6:8.2f} µs')
+        self.stdout.write(f'Pre-rendered:   {cached * 1e6:8.2f} µs ({built / cached:.0f}x faster)')
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from datetime import datetime, timedelta
+import gc
+import pickle
+import random
+import tracemalloc
+
+from bot.session import TestSession
+
+
+def legacy_session(rng, now):
+    """A mid-test session in the old dict layout"""
+    answers = {}
+    for module in (1, 2):
+        for i in range(27):
+            if rng.random() < 0.8:
+                answers[f'module{module}_q{i}'] = rng.choice('ABCD')
+    return {
+        'test_id': rng.randrange(1, 100),
+        'test_name': 'Practice Test',
+        'current_module': 2,
+        'current_question': rng.randrange(27),
+        'answers': answers,
+        'module1_start': now - timedelta(minutes=30),
+        'module2_start': now - timedelta(minutes=2),
+        'module1_time': 1500,
+        'module1_results': (20, 27),
+        'module_deadline': (2, now.timestamp() + 1500),
+    }
+
+
+def measure(build, count):
+    """Traced bytes per object while count objects are alive, and pickled bytes per object"""
+    gc.collect()
+    tracemalloc.start()
+    sessions = [build(i) for i in range(count)]
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    pickled = sum(len(pickle.dumps(session, pickle.HIGHEST_PROTOCOL)) for session in sessions)
+    return traced / count, pickled / count
+
+
+class Command(BaseCommand):
+    help = 'Compare the memory held by dict-based and TestSession test sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        count = options['sessions']
+        now = datetime.now()
+
+        # Both layouts are built from the same random answers
+        def build_legacy(i):
+            return legacy_session(random.Random(i), now)
+
+        def build_compact(i):
+            return TestSession.from_legacy(legacy_session(random.Random(i), now))
+
+        rows = [
+            ('dict', *measure(build_legacy, count)),
+            ('TestSession', *measure(build_compact, count)),
+        ]
+        self.stdout.write(f'{count} sessions')
+        self.stdout.write(f"{'layout':<12} {'bytes/session':>14} {'pickled':>8}")
+        for name, traced, pickled in rows:
+            self.stdout.write(f'{name:<12} {traced:>14.0f} {pickled:>8.0f}')
+        ratio = rows[0][1] / rows[1][1]
+        self.stdout.write(self.style.SUCCESS(f'TestSession uses {ratio:.1f}x less memory'))
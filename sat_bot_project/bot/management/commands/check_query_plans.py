@@ -0,0 +1,93 @@
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+import re
+
+from bot.cache import load_module_bank
+from bot.main import available_tests, load_results_page, load_results_summary, results_cursor
+from bot.models import ScoreBucket, Test, TestResult, User
+
+PHONE = '+0'
+
+
+def get_or_none(queryset, **lookups):
+    try:
+        return queryset.get(**lookups)
+    except ObjectDoesNotExist:
+        return None
+
+
+def older_page():
+    cursor = results_cursor(TestResult(id=0, test_date=timezone.now()))
+    return load_results_page(PHONE, 'older', cursor)
+
+
+def newer_page():
+    cursor = results_cursor(TestResult(id=0, test_date=timezone.now()))
+    return load_results_page(PHONE, 'newer', cursor)
+
+
+# The bot's queries, run the way its handlers run them
+BOT_QUERIES = [
+    ('main menu', lambda: list(available_tests())),
+    ('start test', lambda: get_or_none(Test.objects, id=0, is_complete=True, is_active=True)),
+    ('module questions', lambda: load_module_bank(0, 1)),
+    ('my results', lambda: load_results_page(PHONE)),
+    ('my results, older page', older_page),
+    ('my results, newer page', newer_page),
+    ('my results summary', lambda: load_results_summary(PHONE)),
+    ('score standing', lambda: ScoreBucket.standing(0, 500)),
+    ('login', lambda: get_or_none(User.objects, phone=PHONE)),
+]
+
+
+def partial_indexes(cursor):
+    """Names of the SQLite indexes that only cover rows matching a WHERE clause"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '%WHERE%'")
+    return {name for name, in cursor.fetchall()}
+
+
+def plan_problem(detail, partial):
+    """Why a step of an SQLite query plan is too slow for a bot query, if it is.
+
+    Walking a whole partial index is fine: it only holds the rows the query wants.
+    """
+    if detail.startswith('SCAN ') and detail != 'SCAN CONSTANT ROW':
+        index = re.search(r'USING (?:COVERING )?INDEX (\w+)', detail)
+        if index is None or index.group(1) not in partial:
+            return 'full scan'
+    if 'USE TEMP B-TREE' in detail:
+        return 'sort in a temporary b-tree'
+    return None
+
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN QUERY PLAN on the bot's queries and fail if one scans a table or sorts without an index"
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('EXPLAIN QUERY PLAN checks need the SQLite profile')
+
+        with connection.cursor() as cursor:
+            partial = partial_indexes(cursor)
+
+        failures = 0
+        for name, run in BOT_QUERIES:
+            with CaptureQueriesContext(connection) as queries:
+                run()
+            for query in queries.captured_queries:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                    plan = [row[3] for row in cursor.fetchall()]
+                problems = [plan_problem(detail, partial) for detail in plan]
+                failed = any(problems)
+                failures += failed
+                style = self.style.ERROR if failed else self.style.SUCCESS
+                self.stdout.write(style(f"{'FAIL' if failed else 'ok':<5}{name}"))
+                for detail, problem in zip(plan, problems):
+                    self.stdout.write(f'       {detail}' + (f'  <- {problem}' if problem else ''))
+
+        if failures:
+            raise CommandError(f'{failures} bot queries scan a table or sort without an index')
@@ -0,0 +1,46 @@
+from contextlib import nullcontext
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+import sys
+import time
+
+from bot.export import CHUNK_SIZE, csv_lines, filter_results, pa, result_rows, write_parquet
+
+
+class Command(BaseCommand):
+    help = 'Stream test results, joined with their user and test, to a CSV or Parquet file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='.csv or .parquet file, or - for CSV on stdout')
+        parser.add_argument('--since', type=date.fromisoformat, help='First day (YYYY-MM-DD, UTC)')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last day (YYYY-MM-DD, UTC), inclusive')
+        parser.add_argument('--test', type=int, action='append', dest='tests', help='Test id (repeatable; default all)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Results fetched per round trip')
+
+    def handle(self, *args, **options):
+        output = options['output']
+        if not output.endswith(('.csv', '.parquet')) and output != '-':
+            raise CommandError('expected a .csv or .parquet file, or -')
+        if output.endswith('.parquet') and pa is None:
+            raise CommandError('Parquet export needs pyarrow: pip install pyarrow')
+
+        started = time.perf_counter()
+        queryset = filter_results(since=options['since'], until=options['until'], tests=options['tests'])
+        rows = result_rows(queryset, options['chunk_size'])
+        if output.endswith('.parquet'):
+            written = write_parquet(rows, output, options['chunk_size'])
+        else:
+            written = -1  # Not counting the header
+            if output == '-':
+                destination = nullcontext(sys.stdout)
+            else:
+                destination = open(output, 'w', newline='', encoding='utf-8')
+            with destination as fileobj:
+                for line in csv_lines(rows):
+                    fileobj.write(line)
+                    written += 1
+
+        elapsed = time.perf_counter() - started
+        # The summary goes to stderr when stdout carries the CSV
+        report = self.stderr if output == '-' else self.stdout
+        report.write(f'Exported {written} results in {elapsed:.1f}s', style_func=self.style.SUCCESS)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+from bot.importer import QuestionImportError, import_tests
+
+
+class Command(BaseCommand):
+    help = 'Import tests with their questions from CSV, JSONL or ZIP (with images) files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='.csv, .jsonl, or .zip holding one of them plus images')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        imported = questions = failed = 0
+        for path in options['files']:
+            with open(path, 'rb') as fileobj:
+                try:
+                    for result in import_tests(fileobj, path):
+                        if isinstance(result, QuestionImportError):
+                            failed += 1
+                            self.stderr.write(self.style.ERROR(f'Skipped {result}'))
+                            continue
+                        imported += 1
+                        questions += result.questions
+                        status = 'complete' if result.is_complete else 'incomplete'
+                        self.stdout.write(f'{result.name}: {result.questions} questions ({status})')
+                except QuestionImportError as error:
+                    raise CommandError(f'{path}: {error}')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {imported} tests, {questions} questions in {elapsed:.1f}s'
+        ))
+        if failed:
+            raise CommandError(f'{failed} tests were skipped')
@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Length
+import time
+
+from bot.models import ItemStatistic, Test, TestResult
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+QUESTIONS = 54
+# Share of attempts in each of the upper and lower groups of the discrimination index
+GROUP_SHARE = 0.27
+OPTIONS = {'chose_a': 'A', 'chose_b': 'B', 'chose_c': 'C', 'chose_d': 'D', 'unanswered': '-'}
+
+
+def analyze_items(answers, key):
+    """Item statistics of a test from its attempts.
+
+    answers is an (attempts, questions) uint8 array of answer letters and key
+    the (questions,) array of correct letters. Returns the p-value and
+    discrimination index of each question, and the share of attempts choosing
+    each option, as arrays over the questions.
+    """
+    correct = answers == key
+    by_total = np.argsort(correct.sum(axis=1), kind='stable')
+    group = max(1, round(GROUP_SHARE * len(answers)))
+    discrimination = correct[by_total[-group:]].mean(axis=0) - correct[by_total[:group]].mean(axis=0)
+    shares = {field: (answers == ord(letter)).mean(axis=0) for field, letter in OPTIONS.items()}
+    return correct.mean(axis=0), discrimination, shares
+
+
+def load_answers(test):
+    """The packed answers of a test's attempts as an (attempts, 54) uint8 array"""
+    packed = (
+        TestResult.objects.filter(test=test)
+        .alias(length=Length('answers')).filter(length=QUESTIONS)
+        .values_list('answers', flat=True)
+    )
+    data = ''.join(packed.iterator(chunk_size=10000)).encode('ascii')
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, QUESTIONS)
+
+
+class Command(BaseCommand):
+    help = "Compute each question's p-value, discrimination index and option shares from recorded answers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--test', type=int, action='append', dest='tests', help='Test id (repeatable; default all)')
+        parser.add_argument('--min-attempts', type=int, default=30,
+                            help='Skip tests with fewer recorded attempts, whose statistics would be noise')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('item_analysis needs NumPy: pip install numpy')
+
+        tests = Test.objects.filter(is_complete=True)
+        if options['tests']:
+            tests = tests.filter(pk__in=options['tests'])
+        for test in tests:
+            # Answers are packed by position, so they only line up with
+            # 27 questions in each module; a test edited since is skipped
+            questions = list(test.questions.order_by('module', 'question_number'))
+            if [question.module for question in questions] != [1] * (QUESTIONS // 2) + [2] * (QUESTIONS // 2):
+                self.stdout.write(self.style.WARNING(
+                    f'{test.name}: {len(questions)} questions instead of {QUESTIONS // 2} per module, skipped'
+                ))
+                continue
+
+            started = time.perf_counter()
+            answers = load_answers(test)
+            loaded = time.perf_counter()
+            if len(answers) < options['min_attempts']:
+                self.stdout.write(f'{test.name}: {len(answers)} attempts with answers, skipped')
+                continue
+
+            key = np.frombuffer(''.join(q.correct_answer for q in questions).encode('ascii'), dtype=np.uint8)
+            p_values, discrimination, shares = analyze_items(answers, key)
+            ItemStatistic.objects.bulk_create(
+                [
+                    ItemStatistic(
+                        question=question,
+                        attempts=len(answers),
+                        p_value=float(p_values[i]),
+                        discrimination=float(discrimination[i]),
+                        **{field: float(share[i]) for field, share in shares.items()},
+                    )
+                    for i, question in enumerate(questions)
+                ],
+                update_conflicts=True,
+                unique_fields=['question'],
+                update_fields=['attempts', 'p_value', 'discrimination', *OPTIONS, 'computed_date'],
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'{test.name}: {len(answers)} attempts, loaded in {loaded - started:.2f} s, '
+                f'analyzed and saved in {time.perf_counter() - loaded:.2f} s'
+            ))
+            for i, question in enumerate(questions):
+                if discrimination[i] < 0:
+                    self.stdout.write(self.style.WARNING(
+                        f'  Module {question.module} Q{question.question_number}: negative discrimination '
+                        f'({discrimination[i]:.2f}), check the answer key'
+                    ))
@@ -0,0 +1,430 @@
+from collections import Counter, defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qsl
+import asyncio
+import itertools
+import json
+import logging
+import math
+import random
+import threading
+import time
+
+from bot.handler import build_application, router
+from bot.models import BotSession, Question, Test, User
+from bot.router import (
+    encode, REGISTER, START_TEST, ANSWER, GO_TO_QUESTION, FINISH_MODULE, START_MODULE2, MAIN_MENU,
+)
+
+TOKEN = '123456:LOADTEST'
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Load Test', 'username': 'load_test_bot'}
+FIRST_STUDENT_ID = 7_000_000_000
+QUESTIONS_PER_MODULE = 27
+# Calls that change what the student sees
+SCREEN_METHODS = frozenset({'sendMessage', 'sendPhoto', 'editMessageText', 'editMessageCaption', 'editMessageMedia'})
+
+
+def parse_body(content_type, body):
+    """Parameters of a Bot API request sent as a form, multipart form or JSON"""
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            value = part.get_payload(decode=True)
+            name = part.get_param('name', header='content-disposition')
+            params[name] = value if part.get_filename() else value.decode()
+        return params
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    return dict(parse_qsl(body.decode()))
+
+
+class FakeChat:
+    """One student's chat as the fake Bot API sees it"""
+
+    def __init__(self, chat_id):
+        self.id = chat_id
+        self.screen = None
+        self.changes = []
+        self.calls = Counter()
+        self.message_ids = itertools.count(1)
+        self.condition = asyncio.Condition()
+
+    @property
+    def version(self):
+        return len(self.changes)
+
+    async def show(self, method, params):
+        """Record a sent or edited message as the chat's screen and return it"""
+        if 'message_id' in params:
+            message_id = int(params['message_id'])
+        else:
+            message_id = next(self.message_ids)
+        message = {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': self.id, 'type': 'private'}}
+        markup = json.loads(params.get('reply_markup') or '{}')
+        if 'inline_keyboard' in markup:
+            message['reply_markup'] = markup
+        has_photo = self.screen is not None and 'photo' in self.screen and method == 'editMessageCaption'
+        if method in ('sendPhoto', 'editMessageMedia') or has_photo:
+            caption = json.loads(params['media']).get('caption') if method == 'editMessageMedia' else params.get('caption')
+            message['caption'] = caption or ''
+            message['photo'] = [{
+                'file_id': f'photo-{self.id}-{message_id}',
+                'file_unique_id': f'{self.id}-{message_id}',
+                'width': 1,
+                'height': 1,
+            }]
+        else:
+            message['text'] = params.get('text', '')
+        async with self.condition:
+            self.screen = message
+            self.changes.append(time.perf_counter())
+            self.condition.notify_all()
+        return message
+
+    async def wait(self, predicate, timeout):
+        async with self.condition:
+            await asyncio.wait_for(self.condition.wait_for(predicate), timeout)
+
+
+class FakeBotAPI:
+    """A Bot API stand-in on localhost that serves getUpdates and records every call"""
+
+    def __init__(self):
+        self.chats = {}
+        self.calls = Counter()
+        self.pending = []
+        self.update_ids = itertools.count(1)
+        self.new_updates = asyncio.Event()
+        self.connections = set()
+        self.server = None
+
+    async def start(self):
+        """Start listening and return the base_url to point the bot at"""
+        self.server = await asyncio.start_server(self.serve, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}/bot'
+
+    async def stop(self):
+        self.server.close()
+        # Release a pending long poll; the bot has closed its connections by now
+        self.new_updates.set()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def chat(self, chat_id):
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            chat = self.chats[chat_id] = FakeChat(chat_id)
+        return chat
+
+    def push(self, update):
+        """Queue an update for the bot's next getUpdates"""
+        update['update_id'] = next(self.update_ids)
+        self.pending.append(update)
+        self.new_updates.set()
+
+    async def serve(self, reader, writer):
+        """Answer HTTP/1.1 keep-alive requests on one connection"""
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while request_line := await reader.readline():
+                path = request_line.split()[1].decode()
+                headers = {}
+                while (line := await reader.readline()).strip():
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if headers.get('transfer-encoding') == 'chunked':
+                    body = b''
+                    while size := int((await reader.readline()).strip(), 16):
+                        body += (await reader.readexactly(size + 2))[:-2]
+                    await reader.readline()
+                else:
+                    body = await reader.readexactly(int(headers.get('content-length', 0)))
+                method = path.rsplit('/', 1)[-1]
+                result = await self.call(method, parse_body(headers.get('content-type', ''), body))
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    b'Content-Length: %d\r\n\r\n' % len(payload) + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    async def call(self, method, params):
+        self.calls[method] += 1
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self.get_updates(int(params.get('offset') or 0), float(params.get('timeout') or 0))
+        if method == 'answerCallbackQuery':
+            # Callback query ids are "<chat id>:<n>"
+            self.chat(int(params['callback_query_id'].split(':')[0])).calls[method] += 1
+            return True
+        if 'chat_id' not in params:
+            return True
+        chat = self.chat(int(params['chat_id']))
+        chat.calls[method] += 1
+        if method in SCREEN_METHODS:
+            return await chat.show(method, params)
+        return True
+
+    async def get_updates(self, offset, timeout):
+        """Long-poll: updates from offset on, waiting up to timeout seconds for one"""
+        self.pending = [update for update in self.pending if update['update_id'] >= offset]
+        if not self.pending:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except TimeoutError:
+                pass
+        return self.pending[:100]
+
+
+def buttons(screen):
+    """callback_data of the inline buttons on a message"""
+    if screen is None:
+        return []
+    rows = screen.get('reply_markup', {}).get('inline_keyboard', [])
+    return [button.get('callback_data') for row in rows for button in row]
+
+
+def has_button(data):
+    return lambda screen: data in buttons(screen)
+
+
+class Student:
+    """A virtual student going from /start through registration to a test's results"""
+
+    def __init__(self, api, number, test_id, latencies, think, timeout, seed):
+        self.api = api
+        self.number = number
+        self.test_id = test_id
+        self.latencies = latencies
+        self.think = think
+        self.timeout = timeout
+        self.rng = random.Random(seed + number)
+        self.user = {'id': FIRST_STUDENT_ID + number, 'is_bot': False, 'first_name': f'Student{number}'}
+        self.chat = api.chat(self.user['id'])
+        self.queries = itertools.count(1)
+        self.messages = itertools.count(1)
+
+    async def act(self, label, update, ready=None):
+        """Send an update and wait until the bot shows a screen that satisfies ready.
+
+        The latency recorded is the time until the bot's first visible reply.
+        """
+        await asyncio.sleep(self.think)
+        seen = self.chat.version
+        started = time.perf_counter()
+        self.api.push(update)
+        await self.chat.wait(
+            lambda: self.chat.version > seen and (ready is None or ready(self.chat.screen)),
+            self.timeout,
+        )
+        self.latencies[label].append(self.chat.changes[seen] - started)
+
+    async def tap(self, data, ready=None):
+        _, handler, _ = router.resolve(data)
+        await self.act(handler.__name__, {'callback_query': {
+            'id': f"{self.user['id']}:{next(self.queries)}",
+            'from': self.user,
+            'chat_instance': str(self.user['id']),
+            'message': self.chat.screen,
+            'data': data,
+        }}, ready)
+
+    async def say(self, label, ready=None, **content):
+        await self.act(label, {'message': {
+            'message_id': next(self.messages),
+            'date': int(time.time()),
+            'chat': {'id': self.user['id'], 'type': 'private'},
+            'from': self.user,
+            **content,
+        }}, ready)
+
+    async def run(self):
+        command = [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+        await self.say('start_command', has_button(encode(REGISTER)), text='/start', entities=command)
+        await self.tap(encode(REGISTER))
+        await self.say('process_phone', contact={
+            'phone_number': f'+1555{self.number:07d}',
+            'first_name': self.user['first_name'],
+            'user_id': self.user['id'],
+        })
+        await self.say('process_first_name', text=self.user['first_name'])
+        await self.say('process_last_name', has_button(encode(START_TEST, self.test_id)), text='Load')
+        await self.tap(encode(START_TEST, self.test_id), has_button(encode(GO_TO_QUESTION, 1, 1)))
+
+        for module in (1, 2):
+            if module == 2:
+                await self.tap(encode(START_MODULE2), has_button(encode(GO_TO_QUESTION, 2, 1)))
+            for index in range(QUESTIONS_PER_MODULE):
+                await self.tap(encode(ANSWER, self.rng.choice('ABCD'), module, index))
+                if index < QUESTIONS_PER_MODULE - 1:
+                    await self.tap(encode(GO_TO_QUESTION, module, index + 1))
+            ready = encode(START_MODULE2) if module == 1 else encode(MAIN_MENU)
+            await self.tap(encode(FINISH_MODULE, module), has_button(ready))
+
+
+class QueryCounter:
+    """Counts queries on every database connection opened while it is installed"""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of a sorted list"""
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def create_test():
+    """A complete test with random answer keys for the virtual students to take"""
+    rng = random.Random(0)
+    with transaction.atomic():
+        test = Test.objects.create(name='Load test', is_active=True)
+        Question.objects.bulk_create(
+            Question(
+                test=test, module=module, question_number=number,
+                question_text=f'Load test question {number}',
+                option_a='a', option_b='b', option_c='c', option_d='d',
+                correct_answer=rng.choice('ABCD'),
+            )
+            for module in (1, 2)
+            for number in range(1, QUESTIONS_PER_MODULE + 1)
+        )
+        Test.objects.filter(pk=test.pk).update(is_complete=True)
+    return test.pk
+
+
+class Command(BaseCommand):
+    help = ('Drive virtual students through register, a full test and its results against a local '
+            'Bot API stand-in, and report handler latency, Bot API calls and database queries per session')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=50)
+        parser.add_argument('--ramp', type=float, default=5.0, help='Seconds over which the students start')
+        parser.add_argument('--think', type=float, default=0.0, help='Seconds a student waits before each action')
+        parser.add_argument('--timeout', type=float, default=60.0,
+                            help='Seconds to wait for a reply before the session counts as failed')
+        parser.add_argument('--test-id', type=int, help='Existing complete test to take (default: a generated one)')
+        parser.add_argument('--no-rate-limit', action='store_true',
+                            help="Lift the outgoing rate limits to measure the bot's own latency")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated test, students and results')
+
+    def handle(self, *args, **options):
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        student_ids = [FIRST_STUDENT_ID + number for number in range(options['students'])]
+        phones = [f'+1555{number:07d}' for number in range(options['students'])]
+        User.objects.filter(phone__in=phones).delete()
+        BotSession.objects.filter(telegram_id__in=student_ids).delete()
+
+        test_id = options['test_id']
+        if test_id is None:
+            test_id = create_test()
+        elif not Test.objects.filter(pk=test_id, is_complete=True, is_active=True).exists():
+            raise CommandError(f'Test {test_id} is not complete and active')
+
+        overrides = {}
+        if options['no_rate_limit']:
+            overrides = {'BOT_RATE_OVERALL': 1e6, 'BOT_RATE_PER_CHAT': 1e6, 'BOT_RATE_CHAT_BURST': 1e6}
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        try:
+            with override_settings(**overrides):
+                report = asyncio.run(self.run(test_id, counter, options))
+        finally:
+            connection_created.disconnect(counter.install)
+            if not options['keep']:
+                User.objects.filter(phone__in=phones).delete()
+                BotSession.objects.filter(telegram_id__in=student_ids).delete()
+                if options['test_id'] is None:
+                    Test.objects.filter(pk=test_id).delete()
+        self.print_report(*report, options['students'])
+
+    async def run(self, test_id, counter, options):
+        api = FakeBotAPI()
+        base_url = await api.start()
+        application = build_application(token=TOKEN, base_url=base_url)
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        await application.updater.start_polling(poll_interval=0, timeout=1)
+        await application.start()
+
+        latencies = defaultdict(list)
+        students = [
+            Student(api, number, test_id, latencies, options['think'], options['timeout'], options['seed'])
+            for number in range(options['students'])
+        ]
+
+        async def session(student, delay):
+            await asyncio.sleep(delay)
+            try:
+                await student.run()
+                return True
+            except TimeoutError:
+                screen = student.chat.screen or {}
+                self.stderr.write(f"Student {student.number} got no reply; last screen: "
+                                  f"{(screen.get('text') or screen.get('caption') or '')[:60]!r}")
+                return False
+
+        started = time.perf_counter()
+        try:
+            completed = await asyncio.gather(*(
+                session(student, options['ramp'] * number / len(students))
+                for number, student in enumerate(students)
+            ))
+        finally:
+            elapsed = time.perf_counter() - started
+            await application.updater.stop()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+            await api.stop()
+        return latencies, api, counter.count, sum(completed), elapsed
+
+    def print_report(self, latencies, api, queries, completed, elapsed, students):
+        self.stdout.write(f'{completed}/{students} sessions completed in {elapsed:.1f} s\n')
+        self.stdout.write(f"{'handler':<22}{'calls':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for label, samples in sorted(latencies.items(), key=lambda item: -len(item[1])):
+            ordered = sorted(sample * 1000 for sample in samples)
+            self.stdout.write(
+                f'{label:<22}{len(ordered):>7}'
+                + ''.join(f'{percentile(ordered, p):>10.1f}' for p in (50, 95, 99))
+                + f'{ordered[-1]:>10.1f}'
+            )
+
+        per_chat = Counter()
+        for chat in api.chats.values():
+            per_chat.update(chat.calls)
+        sessions = max(len(api.chats), 1)
+        calls = sum(per_chat.values()) / sessions
+        breakdown = ', '.join(f'{method} {count / sessions:.1f}' for method, count in per_chat.most_common())
+        self.stdout.write(f'\nBot API calls per session: {calls:.1f} ({breakdown})')
+        self.stdout.write(f'Database queries per session: {queries / students:.1f}')
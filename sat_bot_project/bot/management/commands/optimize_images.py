@@ -0,0 +1,38 @@
+from concurrent.futures import as_completed
+from django.core.management.base import BaseCommand
+
+from bot.images import finish, submit
+from bot.models import Test, Question
+
+
+class Command(BaseCommand):
+    help = 'Make Telegram-sized copies of uploaded test and question images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Redo images that already have a copy')
+
+    def handle(self, *args, **options):
+        futures = []
+        for model in (Test, Question):
+            instances = model.objects.exclude(image='').exclude(image=None)
+            if not options['all']:
+                instances = instances.filter(image_optimized='')
+            futures += [submit(instance) for instance in instances.only('pk', 'image')]
+
+        total_original = total_optimized = failed = 0
+        for future in as_completed(futures):
+            result = finish(future)
+            if result is None:
+                failed += 1
+                continue
+            source, original, optimized = result
+            total_original += original
+            total_optimized += optimized
+            self.stdout.write(f'{source}: {original} -> {optimized} bytes ({original - optimized} saved)')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(futures)} images, {total_original - total_optimized} bytes saved '
+            f'({total_original} -> {total_optimized})'
+        ))
+        if failed:
+            self.stderr.write(self.style.ERROR(f'{failed} images could not be optimized, see the log'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from bot.models import ScoreBucket, Test, TestResult
+
+
+class Command(BaseCommand):
+    help = "Recompute every test's score histogram from its results, one test at a time"
+
+    def handle(self, *args, **options):
+        results = buckets = tests = 0
+        for test_id in Test.objects.order_by('pk').values_list('pk', flat=True):
+            # One short transaction per test, so the bot's result saves only
+            # wait for the test being recounted, and only for one GROUP BY
+            with transaction.atomic():
+                # Deleting first holds the buckets' write locks, so results finished
+                # during the count are added on top of the rebuilt counts
+                ScoreBucket.objects.filter(test_id=test_id).delete()
+                counts = (
+                    TestResult.objects.filter(test_id=test_id).order_by()
+                    .values_list('estimated_score').annotate(count=Count('id'))
+                )
+                rebuilt = ScoreBucket.objects.bulk_create(
+                    [ScoreBucket(test_id=test_id, score=score, count=count) for score, count in counts],
+                    # A result saved mid-count may have created its bucket already
+                    update_conflicts=True,
+                    unique_fields=['test', 'score'],
+                    update_fields=['count'],
+                )
+            if rebuilt:
+                tests += 1
+                buckets += len(rebuilt)
+                results += sum(bucket.count for bucket in rebuilt)
+        self.stdout.write(self.style.SUCCESS(
+            f'Counted {results} results into {buckets} buckets of {tests} tests'
+        ))
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from telegram import Bot, Update
+import asyncio
+
+
+class Command(BaseCommand):
+    help = 'Point Telegram at the webhook served by the ASGI app, or go back to polling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='?', help='Public URL of /bot/webhook/, e.g. https://example.com/bot/webhook/')
+        parser.add_argument('--delete', action='store_true', help='Remove the webhook so run_bot.py can poll again')
+        parser.add_argument('--max-connections', type=int, default=40,
+                            help='Concurrent webhook connections Telegram may open (1-100)')
+
+    def handle(self, *args, **options):
+        if not settings.TELEGRAM_BOT_TOKEN:
+            raise CommandError('TELEGRAM_BOT_TOKEN is not set')
+        if options['delete']:
+            asyncio.run(self._delete())
+            self.stdout.write(self.style.SUCCESS('Webhook removed'))
+            return
+        if not options['url']:
+            raise CommandError('Give the webhook URL or --delete')
+        if not settings.TELEGRAM_WEBHOOK_SECRET:
+            raise CommandError('TELEGRAM_WEBHOOK_SECRET is not set')
+        asyncio.run(self._set(options['url'], options['max_connections']))
+        self.stdout.write(self.style.SUCCESS(f"Webhook set to {options['url']}"))
+
+    async def _set(self, url, max_connections):
+        async with Bot(settings.TELEGRAM_BOT_TOKEN) as bot:
+            await bot.set_webhook(
+                url,
+                secret_token=settings.TELEGRAM_WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=max_connections,
+            )
+
+    async def _delete(self):
+        async with Bot(settings.TELEGRAM_BOT_TOKEN) as bot:
+            await bot.delete_webhook()
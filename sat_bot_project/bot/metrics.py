@@ -0,0 +1,268 @@
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from telegram.request import HTTPXRequest
+import asyncio
+import functools
+import hmac
+import logging
+import math
+import threading
+import time
+
+from .concurrency import ChatOrderedUpdateProcessor
+from .ratelimit import OutboundRateLimiter
+from .session import peek_session
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# Seconds, from a cached tap to a Bot API call stuck behind the flood limits
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Handler of the update being processed, inherited by the database threads it awaits
+current_handler = ContextVar('current_handler', default='other')
+
+_application = None
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Prometheus histogram with one label, safe to observe from any thread"""
+
+    def __init__(self, name, documentation, label, buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # A count per bucket (the last one is +Inf), then the sum
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {label_value: list(counts) for label_value, counts in self._series.items()}
+        for label_value, counts in sorted(series.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label},le="{format_value(bound)}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label}}} {format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{{{label}}} {cumulative}')
+        return lines
+
+
+class Counter:
+    """Prometheus counter with one label, or none"""
+
+    def __init__(self, name, documentation, label):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_value=None, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = dict(self._values)
+        for label_value, value in sorted(values.items()):
+            if self.label is None:
+                lines.append(f'{self.name} {format_value(value)}')
+            else:
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {format_value(value)}')
+        return lines
+
+
+def gauge(name, documentation, values, label=None, kind='gauge'):
+    """Lines of a value read at scrape time: a number, or {label value: number} when label is given"""
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    if label is None:
+        lines.append(f'{name} {format_value(values)}')
+    else:
+        for label_value, value in sorted(values.items()):
+            lines.append(f'{name}{{{label}="{label_value}"}} {format_value(value)}')
+    return lines
+
+
+handler_seconds = Histogram('bot_handler_seconds', 'Time to handle an update, by handler', 'handler')
+handler_errors = Counter('bot_handler_errors_total', 'Updates whose handler raised, by handler', 'handler')
+db_query_seconds = Histogram(
+    'bot_db_query_seconds', 'Database query time, by the handler that ran the query', 'handler'
+)
+api_seconds = Histogram('bot_api_seconds', 'Bot API request time, by method', 'method')
+api_errors = Counter('bot_api_errors_total', 'Bot API requests that failed, by method', 'method')
+callbacks_rejected = Counter('bot_callbacks_rejected_total', 'Callback queries with unknown or malformed data', None)
+
+
+@asynccontextmanager
+async def track_handler(name):
+    """Time a handler and attribute the queries it runs to it"""
+    token = current_handler.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        handler_errors.inc(name)
+        raise
+    finally:
+        handler_seconds.observe(name, time.perf_counter() - started)
+        current_handler.reset(token)
+
+
+def instrumented(handler):
+    """Decorate an update handler with track_handler under its own name"""
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        async with track_handler(handler.__name__):
+            return await handler(*args, **kwargs)
+    return wrapper
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper recording each query's duration"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        db_query_seconds.observe(current_handler.get(), time.perf_counter() - started)
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records the duration and failures of each Bot API call"""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        endpoint = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        code = None
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            return code, payload
+        finally:
+            api_seconds.observe(endpoint, time.perf_counter() - started)
+            if code is None or code >= 400:
+                api_errors.inc(endpoint)
+
+
+def watch(application):
+    """Report the gauges of this Application (sessions, queues, caches)"""
+    global _application
+    _application = application
+
+
+def application_gauges(application):
+    sessions = {1: 0, 2: 0}
+    for user_data in list(application.user_data.values()):
+        # Scrapes only read: upgrading legacy sessions is left to the handlers
+        session = peek_session(user_data)
+        if session is not None and session.in_progress(session.module):
+            sessions[session.module] += 1
+    lines = gauge('bot_active_sessions', 'Tests with a module in progress, by module', sessions, 'module')
+
+    timers = application.bot_data.get('module_timers')
+    lines += gauge('bot_module_deadlines', 'Module deadlines scheduled', len(timers) if timers is not None else 0)
+    if isinstance(application.update_processor, ChatOrderedUpdateProcessor):
+        lines += gauge('bot_active_chats', 'Chats with an update being processed',
+                       application.update_processor.active_chats)
+
+    limiter = application.bot.rate_limiter
+    if isinstance(limiter, OutboundRateLimiter):
+        stats = limiter.stats()
+        lines += gauge('bot_rate_limiter_queue_depth', 'Bot API calls waiting for a token', stats['queue_depth'])
+        lines += gauge('bot_rate_limiter_retry_after_total', 'Flood-limit responses received',
+                       stats['retry_after'], kind='counter')
+    return lines
+
+
+def cache_metrics():
+    # Imported here: the cache imports the renderer, whose router reports to this module
+    from .cache import question_bank, user_profiles
+
+    caches = {'questions': question_bank.stats(), 'users': user_profiles.stats()}
+    lines = gauge('bot_cache_size', 'Entries in an in-process cache',
+                  {name: stats['size'] for name, stats in caches.items()}, 'cache')
+    for key in ('hits', 'misses'):
+        lines += gauge(f'bot_cache_{key}_total', f'In-process cache {key}',
+                       {name: stats[key] for name, stats in caches.items()}, 'cache', kind='counter')
+    return lines
+
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in (handler_seconds, handler_errors, db_query_seconds, api_seconds, api_errors, callbacks_rejected):
+        lines += metric.render()
+    lines += cache_metrics()
+    if _application is not None:
+        lines += application_gauges(_application)
+    return '\n'.join(lines) + '\n'
+
+
+def authorized(authorization):
+    """Whether an Authorization header carries BOT_METRICS_TOKEN (when one is set)"""
+    token = settings.BOT_METRICS_TOKEN
+    return not token or hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+
+
+async def metrics_view(request):
+    """Prometheus scrape endpoint of the webhook bot running in this process.
+
+    It is served by the public app, so it stays closed until BOT_METRICS_TOKEN is set.
+    """
+    if not settings.BOT_METRICS_TOKEN or not authorized(request.headers.get('Authorization', '')):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
+async def serve_metrics(host, port):
+    """Serve GET /metrics on a small side server, for the polling bot"""
+    async def respond(reader, writer):
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while (line := await reader.readline()).strip():
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] != 'GET' or parts[1].split('?')[0] != '/metrics':
+                status, body = '404 Not Found', b''
+            elif not authorized(headers.get('authorization', '')):
+                status, body = '403 Forbidden', b''
+            else:
+                status, body = '200 OK', render_metrics().encode()
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        except Exception:
+            logger.exception('Metrics request failed')
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(respond, host, port)
+    logger.info('Metrics on http://%s:%s/metrics', host, port)
+    return server
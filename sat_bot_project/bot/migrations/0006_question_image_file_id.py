@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0005_alter_question_id_alter_question_image_alter_test_id_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="question",
+            name="image_file_id",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="Telegram file_id of the uploaded image",
+                max_length=255,
+            ),
+        ),
+    ]
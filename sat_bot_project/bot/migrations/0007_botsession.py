@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0006_question_image_file_id"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BotSession",
+            fields=[
+                (
+                    "telegram_id",
+                    models.BigIntegerField(primary_key=True, serialize=False),
+                ),
+                (
+                    "data",
+                    models.BinaryField(
+                        help_text="Pickled user_data of the bot session"
+                    ),
+                ),
+                ("updated_date", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Bot Session",
+                "verbose_name_plural": "Bot Sessions",
+            },
+        ),
+    ]
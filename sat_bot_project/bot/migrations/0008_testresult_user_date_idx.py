@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0007_botsession"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="testresult",
+            index=models.Index(
+                fields=["user", "-test_date", "-id"], name="testresult_user_date_idx"
+            ),
+        ),
+    ]
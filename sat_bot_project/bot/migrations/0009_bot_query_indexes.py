@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0008_testresult_user_date_idx"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="test",
+            index=models.Index(
+                condition=models.Q(("is_active", True), ("is_complete", True)),
+                fields=["-created_date"],
+                name="test_available_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="testresult",
+            index=models.Index(
+                fields=["user", "test", "-test_date", "-id"],
+                name="testresult_user_test_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0009_bot_query_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="question",
+            name="image_optimized",
+            field=models.ImageField(
+                blank=True,
+                editable=False,
+                help_text="Downscaled JPEG of the image, sent to Telegram",
+                upload_to="images/optimized/",
+            ),
+        ),
+        migrations.AddField(
+            model_name="test",
+            name="image_optimized",
+            field=models.ImageField(
+                blank=True,
+                editable=False,
+                help_text="Downscaled JPEG of the image, sent to Telegram",
+                upload_to="images/optimized/",
+            ),
+        ),
+    ]
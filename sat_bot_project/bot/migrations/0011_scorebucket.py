@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0010_image_optimized"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScoreBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("score", models.IntegerField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "test",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="score_buckets",
+                        to="bot.test",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Score Bucket",
+                "verbose_name_plural": "Score Buckets",
+                "unique_together": {("test", "score")},
+            },
+        ),
+    ]
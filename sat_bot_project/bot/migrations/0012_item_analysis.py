@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("bot", "0011_scorebucket"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ItemStatistic",
+            fields=[
+                (
+                    "question",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="statistic",
+                        serialize=False,
+                        to="bot.question",
+                    ),
+                ),
+                ("attempts", models.PositiveIntegerField()),
+                (
+                    "p_value",
+                    models.FloatField(
+                        help_text="Share of attempts answering correctly"
+                    ),
+                ),
+                (
+                    "discrimination",
+                    models.FloatField(
+                        help_text="Share correct in the top 27% of attempts by total score minus the share in the bottom 27%"
+                    ),
+                ),
+                ("chose_a", models.FloatField()),
+                ("chose_b", models.FloatField()),
+                ("chose_c", models.FloatField()),
+                ("chose_d", models.FloatField()),
+                ("unanswered", models.FloatField()),
+                ("computed_date", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name": "Item Statistic",
+                "verbose_name_plural": "Item Statistics",
+            },
+        ),
+        migrations.AddField(
+            model_name="testresult",
+            name="answers",
+            field=models.CharField(
+                blank=True,
+                help_text="Answer letter per question, Module 1 then Module 2 in question order; '-' unanswered",
+                max_length=54,
+            ),
+        ),
+    ]
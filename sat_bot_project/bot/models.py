@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.core.exceptions import ValidationError
 
 class User(models.Model):
@@ -20,6 +20,8 @@ class Test(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='images/', blank=True, null=True)
+    image_optimized = models.ImageField(upload_to='images/optimized/', blank=True, editable=False,
+                                        help_text="Downscaled JPEG of the image, sent to Telegram")
     created_date = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
     is_complete = models.BooleanField(default=False, editable=False)
@@ -28,6 +30,15 @@ class Test(models.Model):
         verbose_name = 'Test'
         verbose_name_plural = 'Tests'
         ordering = ['-created_date']
+        indexes = [
+            # Main menu: available tests, newest first. Partial, since SQLite
+            # can't seek an index on the bare boolean columns Django filters with
+            models.Index(
+                fields=['-created_date'],
+                condition=models.Q(is_complete=True, is_active=True),
+                name='test_available_idx',
+            ),
+        ]
     
     def __str__(self):
         status = "✅ Complete" if self.is_complete else "⚠️ Incomplete"
@@ -37,8 +48,12 @@ class Test(models.Model):
         super().save(*args, **kwargs)
     
     def get_question_counts(self):
-        module1_count = self.questions.filter(module=1).count()
-        module2_count = self.questions.filter(module=2).count()
+        counts = self.questions.aggregate(
+            module1=models.Count('id', filter=models.Q(module=1)),
+            module2=models.Count('id', filter=models.Q(module=2)),
+        )
+        module1_count = counts['module1']
+        module2_count = counts['module2']
         return {
             'module1': module1_count,
             'module2': module2_count,
@@ -57,6 +72,10 @@ class Question(models.Model):
     question_number = models.IntegerField()
     question_text = models.TextField()
     image = models.ImageField(upload_to='images/', blank=True, null=True)
+    image_optimized = models.ImageField(upload_to='images/optimized/', blank=True, editable=False,
+                                        help_text="Downscaled JPEG of the image, sent to Telegram")
+    image_file_id = models.CharField(max_length=255, blank=True, editable=False,
+                                     help_text="Telegram file_id of the uploaded image")
     option_a = models.TextField()
     option_b = models.TextField()
     option_c = models.TextField()
@@ -104,11 +123,96 @@ class TestResult(models.Model):
     
     module1_time_taken = models.IntegerField(help_text="Time taken in seconds")
     module2_time_taken = models.IntegerField(help_text="Time taken in seconds")
+    answers = models.CharField(max_length=54, blank=True,
+                               help_text="Answer letter per question, Module 1 then Module 2 in question order; '-' unanswered")
     
     class Meta:
         verbose_name = 'Test Result'
         verbose_name_plural = 'Test Results'
         ordering = ['-test_date']
+        indexes = [
+            # Keyset pagination of a user's results, newest first
+            models.Index(fields=['user', '-test_date', '-id'], name='testresult_user_date_idx'),
+            # Per-test summary of a user's results
+            models.Index(fields=['user', 'test', '-test_date', '-id'], name='testresult_user_test_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user} - {self.test.name} - Score: {self.estimated_score}"
+
+
+class ItemStatistic(models.Model):
+    """Item analysis of a question over the attempts that recorded their answers (see item_analysis)"""
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True, related_name='statistic')
+    attempts = models.PositiveIntegerField()
+    p_value = models.FloatField(help_text="Share of attempts answering correctly")
+    discrimination = models.FloatField(
+        help_text="Share correct in the top 27% of attempts by total score minus the share in the bottom 27%"
+    )
+    chose_a = models.FloatField()
+    chose_b = models.FloatField()
+    chose_c = models.FloatField()
+    chose_d = models.FloatField()
+    unanswered = models.FloatField()
+    computed_date = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Item Statistic'
+        verbose_name_plural = 'Item Statistics'
+    
+    def __str__(self):
+        return f"{self.question} - p={self.p_value:.2f}, D={self.discrimination:.2f}"
+
+
+class ScoreBucket(models.Model):
+    """Number of a test's results with one estimated score: a bar of its score histogram.
+
+    Kept up to date by signals as results are saved and deleted, so a score's
+    standing is one aggregate over at most a few hundred rows.
+    """
+    test = models.ForeignKey(Test, on_delete=models.CASCADE, related_name='score_buckets')
+    score = models.IntegerField()
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        verbose_name = 'Score Bucket'
+        verbose_name_plural = 'Score Buckets'
+        unique_together = ['test', 'score']
+    
+    def __str__(self):
+        return f"{self.test_id} - {self.score}: {self.count}"
+    
+    @classmethod
+    def add(cls, test_id, score, count=1):
+        """Add count results (negative to remove them) to a score's bucket"""
+        buckets = cls.objects.filter(test_id=test_id, score=score)
+        if buckets.update(count=models.F('count') + count) or count < 0:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(test_id=test_id, score=score, count=count)
+        except IntegrityError:
+            # Another result created the bucket first
+            buckets.update(count=models.F('count') + count)
+    
+    @classmethod
+    def standing(cls, test_id, score):
+        """Results of a test scoring below, scoring the same as, and in total, for a score"""
+        return cls.objects.filter(test_id=test_id).aggregate(
+            below=models.Sum('count', filter=models.Q(score__lt=score), default=0),
+            same=models.Sum('count', filter=models.Q(score=score), default=0),
+            total=models.Sum('count', default=0),
+        )
+
+
+class BotSession(models.Model):
+    telegram_id = models.BigIntegerField(primary_key=True)
+    data = models.BinaryField(help_text="Pickled user_data of the bot session")
+    updated_date = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Bot Session'
+        verbose_name_plural = 'Bot Sessions'
+    
+    def __str__(self):
+        return f"Session {self.telegram_id}"
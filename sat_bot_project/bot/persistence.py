@@ -0,0 +1,129 @@
+from telegram.ext import BasePersistence, PersistenceInput
+from django.db import transaction
+from django.utils import timezone
+from .db import database_sync_to_async
+import asyncio
+import logging
+import pickle
+
+from .models import BotSession
+
+logger = logging.getLogger(__name__)
+
+
+class DjangoPersistence(BasePersistence):
+    """Stores user_data in the BotSession table with write-behind batching.
+
+    The application hands over changed user_data once per update_interval;
+    those changes are buffered and written with a single bulk upsert (plus one
+    delete for cleared sessions) instead of one query per user.
+    """
+
+    def __init__(self, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._pending = {}
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    async def get_user_data(self):
+        return await database_sync_to_async(self._load_user_data)()
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_user_data(self, user_id, data):
+        self._pending[user_id] = pickle.dumps(data, pickle.HIGHEST_PROTOCOL) if data else None
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._pending[user_id] = None
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        await self._write_pending()
+
+    def _schedule_flush(self):
+        # All user_data of one persistence run is handed over in the same loop
+        # iteration, so deferring the write by one iteration batches the run
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        async with self._write_lock:
+            await asyncio.sleep(0)
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                await database_sync_to_async(self._write)(pending)
+            except Exception:
+                logger.exception('Could not persist %d bot sessions', len(pending))
+                # Keep anything newer that arrived while writing
+                self._pending = {**pending, **self._pending}
+
+    @staticmethod
+    def _load_user_data():
+        user_data = {}
+        for telegram_id, data in BotSession.objects.values_list('telegram_id', 'data').iterator():
+            try:
+                user_data[telegram_id] = pickle.loads(data)
+            except Exception:
+                logger.warning('Discarding unreadable session of user %s', telegram_id)
+        logger.info('Restored %d bot sessions', len(user_data))
+        return user_data
+
+    @staticmethod
+    def _write(pending):
+        now = timezone.now()
+        sessions = [
+            BotSession(telegram_id=telegram_id, data=data, updated_date=now)
+            for telegram_id, data in pending.items()
+            if data is not None
+        ]
+        dropped = [telegram_id for telegram_id, data in pending.items() if data is None]
+        with transaction.atomic():
+            if sessions:
+                BotSession.objects.bulk_create(
+                    sessions,
+                    update_conflicts=True,
+                    unique_fields=['telegram_id'],
+                    update_fields=['data', 'updated_date'],
+                )
+            if dropped:
+                BotSession.objects.filter(telegram_id__in=dropped).delete()
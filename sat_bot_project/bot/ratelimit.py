@@ -0,0 +1,206 @@
+from datetime import timedelta
+from itertools import count
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+import asyncio
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Requests answering a tap go ahead of new messages
+INTERACTIVE, BULK = 0, 1
+INTERACTIVE_ENDPOINTS = frozenset({
+    'answerCallbackQuery',
+    'editMessageText',
+    'editMessageCaption',
+    'editMessageMedia',
+    'editMessageReplyMarkup',
+    'deleteMessage',
+})
+# Replies to a tap that only change the user's own screen. They come as fast
+# as the user taps, so they skip the per-chat bucket meant for new messages
+CHAT_EXEMPT_ENDPOINTS = INTERACTIVE_ENDPOINTS
+# Not counted against Telegram's overall broadcast limit either
+UNLIMITED_ENDPOINTS = frozenset({'answerCallbackQuery'})
+
+
+class TokenBucket:
+    """rate tokens per second, holding at most capacity"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available"""
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """Take a token, going into debt if there is none; returns the seconds to wait for it"""
+        wait = self.delay(now)
+        self.tokens -= 1
+        return wait
+
+
+class OutboundRateLimiter(BaseRateLimiter):
+    """Keeps the bot's Bot API calls under Telegram's flood limits.
+
+    Every call takes a token from the overall bucket, and calls that post a
+    new message to a chat also from that chat's bucket; callback answers
+    take neither. When the overall bucket is empty,
+    calls wait in a priority queue where edits and callback answers (the
+    reply to a tap) go before new messages. A RetryAfter pauses all calls
+    for the time Telegram asks and the call is retried.
+    """
+
+    __slots__ = ('_overall', '_chat_rate', '_chat_burst', '_group_rate', '_max_retries', '_chats',
+                 '_waiting', '_seq', '_wakeup', '_task', '_paused_until', '_waits', '_retries')
+
+    def __init__(self, overall_rate=30, overall_burst=30, chat_rate=1, chat_burst=3,
+                 group_rate=20 / 60, max_retries=3):
+        self._overall = TokenBucket(overall_rate, overall_burst)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._max_retries = max_retries
+        self._chats = {}
+        self._waiting = []
+        self._seq = count()
+        self._wakeup = None
+        self._task = None
+        self._paused_until = 0.0
+        # Per priority: [calls, calls that waited, total wait, longest wait]
+        self._waits = {INTERACTIVE: [0, 0, 0.0, 0.0], BULK: [0, 0, 0.0, 0.0]}
+        self._retries = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for _, _, future in self._waiting:
+            future.cancel()
+        self._waiting.clear()
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if isinstance(rate_limit_args, int):
+            priority = rate_limit_args
+        else:
+            priority = INTERACTIVE if endpoint in INTERACTIVE_ENDPOINTS else BULK
+        chat_id = None if endpoint in CHAT_EXEMPT_ENDPOINTS else data.get('chat_id')
+
+        for attempt in range(self._max_retries + 1):
+            started = time.monotonic()
+            if isinstance(chat_id, int):
+                await self._chat_turn(chat_id, started)
+            if endpoint in UNLIMITED_ENDPOINTS:
+                if self._paused_until > started:
+                    await asyncio.sleep(self._paused_until - started)
+            else:
+                await self._overall_turn(priority)
+            self._record_wait(priority, time.monotonic() - started)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as error:
+                if attempt == self._max_retries:
+                    raise
+                retry_after = error.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self._retries += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                logger.warning('Flood limit on %s, pausing all calls for %ss', endpoint, retry_after)
+
+    async def _chat_turn(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                self._forget_idle_chats(now)
+            # Negative ids are groups and channels, which have a lower limit
+            rate = self._chat_rate if chat_id > 0 else self._group_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self._chat_burst)
+        wait = bucket.take(now)
+        if wait:
+            await asyncio.sleep(wait)
+
+    def _forget_idle_chats(self, now):
+        for chat_id, bucket in list(self._chats.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._chats[chat_id]
+
+    async def _overall_turn(self, priority):
+        now = time.monotonic()
+        if not self._waiting and now >= self._paused_until and not self._overall.delay(now):
+            self._overall.take(now)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._seq), future))
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        """Hand out overall tokens to waiting calls, most urgent first"""
+        while True:
+            while self._waiting:
+                now = time.monotonic()
+                wait = max(self._paused_until - now, self._overall.delay(now))
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                _, _, future = heapq.heappop(self._waiting)
+                if not future.done():
+                    self._overall.take(now)
+                    future.set_result(None)
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    def _record_wait(self, priority, waited):
+        stats = self._waits.setdefault(priority, [0, 0, 0.0, 0.0])
+        stats[0] += 1
+        if waited > 0.001:
+            stats[1] += 1
+            stats[2] += waited
+            stats[3] = max(stats[3], waited)
+
+    @property
+    def queue_depth(self):
+        """Calls waiting for an overall token"""
+        return len(self._waiting)
+
+    def stats(self):
+        names = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+        return {
+            'queue_depth': self.queue_depth,
+            'retry_after': self._retries,
+            'chats_tracked': len(self._chats),
+            **{
+                names.get(priority, f'priority_{priority}'): {
+                    'calls': calls,
+                    'delayed': delayed,
+                    'avg_wait': total / delayed if delayed else 0.0,
+                    'max_wait': longest,
+                }
+                for priority, (calls, delayed, total, longest) in self._waits.items()
+            },
+        }
@@ -2,13 +2,15 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Keyboar
 from telegram.ext import ContextTypes
 from .models import User
 from django.db import IntegrityError
-from asgiref.sync import sync_to_async
+from .cache import get_user_profile
+from .db import database_sync_to_async
+from .router import encode, REGISTER, LOGIN
 
 async def show_auth_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show registration/login menu"""
     keyboard = [
-        [InlineKeyboardButton("📝 Register", callback_data='register')],
-        [InlineKeyboardButton("🔐 Login", callback_data='login')]
+        [InlineKeyboardButton("📝 Register", callback_data=encode(REGISTER))],
+        [InlineKeyboardButton("🔐 Login", callback_data=encode(LOGIN))]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
@@ -61,7 +63,17 @@ async def handle_login(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=kb
     )
 
-@sync_to_async
+async def auto_login(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Log in the user registered with this Telegram account; returns whether they were"""
+    if context.user_data.get('logged_out'):
+        return False
+    profile = await get_user_profile(update.effective_user.id)
+    if profile is None:
+        return False
+    context.user_data['user'] = profile
+    return True
+
+@database_sync_to_async
 def get_user_by_phone(phone):
     """Get user from database"""
     try:
@@ -69,14 +81,14 @@ def get_user_by_phone(phone):
     except User.DoesNotExist:
         return None
 
-@sync_to_async
+@database_sync_to_async
 def update_user_telegram_id(user, telegram_id):
     """Update user's telegram ID"""
     user.telegram_id = telegram_id
     user.save()
     return user
 
-@sync_to_async
+@database_sync_to_async
 def create_new_user(phone, first_name, last_name, telegram_id):
     """Create new user in database"""
     return User.objects.create(
@@ -118,6 +130,7 @@ async def process_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'first_name': user.first_name,
             'last_name': user.last_name
         }
+        context.user_data.pop('logged_out', None)
         
         # Always login if user exists
         await update.message.reply_text(
@@ -130,7 +143,7 @@ async def process_phone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         # User doesn't exist
         if action == 'login':
-            keyboard = [[InlineKeyboardButton('📝 Register Now', callback_data='register')]]
+            keyboard = [[InlineKeyboardButton('📝 Register Now', callback_data=encode(REGISTER))]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await update.message.reply_text(
                 '❌ Phone number not found. Please register first.',
@@ -183,6 +196,7 @@ async def process_last_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
             'first_name': user.first_name,
             'last_name': user.last_name
         }
+        context.user_data.pop('logged_out', None)
         
         await update.message.reply_text(
             f'✅ Registration successful!\n'
@@ -210,5 +224,7 @@ async def handle_logout(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     context.user_data.clear()
+    # Stay logged out on /start until they log in with their phone again
+    context.user_data['logged_out'] = True
     await show_auth_menu(update, context)
 
@@ -0,0 +1,162 @@
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest
+from collections import Counter
+import logging
+
+from .router import encode, ANSWER, GO_TO_QUESTION, FINISH_MODULE
+
+logger = logging.getLogger(__name__)
+
+# Selection states of a question: unanswered, then each option
+SELECTIONS = (None, 'A', 'B', 'C', 'D')
+
+# Bot API calls issued per rendering flow, keyed by (flow, method)
+api_calls = Counter()
+renders = Counter()
+
+
+def screen_of(message):
+    """Describe a bot message that can be replaced: (chat_id, message_id, has_photo)"""
+    return (message.chat_id, message.message_id, bool(message.photo))
+
+
+def question_buttons(module, index, count):
+    """Option buttons unchecked and checked, and the navigation row, of a question"""
+    options = {}
+    for option_letter in ['A', 'B', 'C', 'D']:
+        callback_data = encode(ANSWER, option_letter, module, index)
+        options[option_letter] = (
+            InlineKeyboardButton(option_letter, callback_data=callback_data),
+            InlineKeyboardButton(f'✅ {option_letter}', callback_data=callback_data),
+        )
+    
+    # Navigation buttons
+    nav_buttons = []
+    if index > 0:
+        nav_buttons.append(InlineKeyboardButton('⬅️ Previous', callback_data=encode(GO_TO_QUESTION, module, index - 1)))
+    if index < count - 1:
+        nav_buttons.append(InlineKeyboardButton('Next ➡️', callback_data=encode(GO_TO_QUESTION, module, index + 1)))
+    else:
+        nav_buttons.append(InlineKeyboardButton('✅ Finish Module', callback_data=encode(FINISH_MODULE, module)))
+    return options, nav_buttons
+
+
+def question_screen(question, module, index, count, selected, buttons=None):
+    """Body text (everything below the timer line) and keyboard of a question"""
+    text = f'Question {index + 1}/{count}\n\n'
+    text += f'{question.question_text}\n\n'
+    
+    # Add options to the message text
+    text += 'Options:\n'
+    for option_letter in ['A', 'B', 'C', 'D']:
+        option_text = getattr(question, f'option_{option_letter.lower()}')
+        prefix = '✅ ' if selected == option_letter else ''
+        text += f'{prefix}{option_letter}) {option_text}\n'
+    text += '\n'
+    
+    options, nav_buttons = buttons or question_buttons(module, index, count)
+    keyboard = [[options[option_letter][selected == option_letter]] for option_letter in ['A', 'B', 'C', 'D']]
+    keyboard.append(nav_buttons)
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def question_screens(questions, module):
+    """Every question's screen in each selection state, indexed [question][SELECTIONS index].
+
+    The navigation row only depends on the question's position, so these are
+    all the screens a module can show apart from the timer line. The states
+    of a question share their button objects.
+    """
+    screens = []
+    for index, question in enumerate(questions):
+        buttons = question_buttons(module, index, len(questions))
+        screens.append(tuple(
+            question_screen(question, module, index, len(questions), selected, buttons)
+            for selected in SELECTIONS
+        ))
+    return tuple(screens)
+
+
+def render_stats():
+    """Bot API calls per flow, with the average number of calls per render"""
+    stats = {}
+    for flow, count in renders.items():
+        calls = {method: n for (call_flow, method), n in api_calls.items() if call_flow == flow}
+        stats[flow] = {
+            'renders': count,
+            'calls': calls,
+            'calls_per_render': sum(calls.values()) / count,
+        }
+    return stats
+
+
+async def render(bot, screen, text, reply_markup=None, photo=None, keep_photo=False, flow='other'):
+    """Show text, or a photo captioned with text, in place of the message on screen.
+
+    The message is edited in place whenever its type allows it: text to text
+    via edit_message_text, photo to the same photo via edit_message_caption
+    (keep_photo) and photo to another photo via edit_message_media. Only a
+    switch between text and photo falls back to delete + send; a screen
+    without message_id just sends. `photo` is a file_id or an open file.
+    Returns the message now on screen, or None when Telegram reports that
+    nothing changed.
+    """
+    renders[flow] += 1
+
+    def call(method):
+        api_calls[(flow, method)] += 1
+        logger.debug('render %s: %s', flow, method)
+
+    chat_id, message_id, has_photo = screen
+    if message_id is not None:
+        try:
+            if has_photo and keep_photo:
+                call('edit_message_caption')
+                return await bot.edit_message_caption(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    caption=text,
+                    reply_markup=reply_markup
+                )
+            if has_photo and photo is not None:
+                call('edit_message_media')
+                return await bot.edit_message_media(
+                    media=InputMediaPhoto(photo, caption=text),
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    reply_markup=reply_markup
+                )
+            if not has_photo and photo is None:
+                call('edit_message_text')
+                return await bot.edit_message_text(
+                    text,
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    reply_markup=reply_markup
+                )
+        except BadRequest as e:
+            if 'not modified' in e.message.lower():
+                return None
+            # Message too old or already gone: replace it below
+            logger.warning('Could not edit message %s in chat %s: %s', message_id, chat_id, e.message)
+
+        call('delete_message')
+        try:
+            await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        except BadRequest as e:
+            logger.warning('Could not delete message %s in chat %s: %s', message_id, chat_id, e.message)
+
+    if photo is not None:
+        call('send_photo')
+        return await bot.send_photo(
+            chat_id=chat_id,
+            photo=photo,
+            caption=text,
+            reply_markup=reply_markup
+        )
+    call('send_message')
+    return await bot.send_message(
+        chat_id=chat_id,
+        text=text,
+        reply_markup=reply_markup
+    )
@@ -0,0 +1,157 @@
+from collections import Counter
+import inspect
+import logging
+import time
+
+from .metrics import callbacks_rejected, track_handler
+
+logger = logging.getLogger(__name__)
+
+# callback_data is "<version><route>[:arg...]", e.g. "1a:B:1:4" answers B to
+# question 5 of module 1. Bump VERSION when the arguments of a route change;
+# data without a version is the original unversioned format.
+VERSION = '1'
+SEPARATOR = ':'
+
+REGISTER = 'rg'
+LOGIN = 'lg'
+LOGOUT = 'lo'
+MAIN_MENU = 'mm'
+START_TEST = 't'
+MY_RESULTS = 'r'
+RESULTS_PAGE = 'rp'
+ANSWER = 'a'
+GO_TO_QUESTION = 'q'
+NEXT_QUESTION = 'nx'
+PREV_QUESTION = 'pv'
+FINISH_MODULE = 'f'
+START_MODULE2 = 's2'
+
+# Buttons sent before the versioned format: exact strings and "prefix_arg_arg"
+LEGACY_EXACT = {
+    'register': REGISTER,
+    'login': LOGIN,
+    'logout': LOGOUT,
+    'main_menu': MAIN_MENU,
+    'my_results': MY_RESULTS,
+    'next_question': NEXT_QUESTION,
+    'prev_question': PREV_QUESTION,
+    'finish_module': FINISH_MODULE,
+    'start_module2': START_MODULE2,
+}
+LEGACY_PREFIXES = {
+    'test': START_TEST,
+    'answer': ANSWER,
+    'results': RESULTS_PAGE,
+}
+
+
+def encode(route, *args):
+    """callback_data for a route and its arguments (at most 64 bytes)"""
+    data = SEPARATOR.join([VERSION + route, *map(str, args)])
+    if len(data.encode()) > 64:
+        raise ValueError(f'callback_data too long: {data}')
+    return data
+
+
+def decode(data):
+    """(route, args) of callback_data, or None if it is not a known format"""
+    if not data:
+        return None
+    if data.startswith(VERSION):
+        route, *args = data[len(VERSION):].split(SEPARATOR)
+        return route, args
+    if data in LEGACY_EXACT:
+        return LEGACY_EXACT[data], []
+    prefix, _, rest = data.partition('_')
+    if prefix in LEGACY_PREFIXES and rest:
+        return LEGACY_PREFIXES[prefix], rest.split('_')
+    return None
+
+
+def choice(*values):
+    """Converter accepting only the given strings"""
+    def convert(value):
+        if value not in values:
+            raise ValueError(value)
+        return value
+    return convert
+
+
+class CallbackRouter:
+    """Dispatches callback queries to handlers registered by route code.
+
+    A handler is called as handler(update, context, *args) with each argument
+    passed through its converter; trailing arguments the handler has defaults
+    for may be missing, so older buttons with fewer arguments reach the same
+    handler. Unknown or malformed
+    data is answered with a notice instead of raising.
+    """
+
+    def __init__(self):
+        self._routes = {}
+        self.calls = Counter()
+        self.seconds = Counter()
+        self.slowest = Counter()
+        self.rejected = 0
+
+    def add(self, route, handler, *converters):
+        if route in self._routes:
+            raise ValueError(f'Route {route} is already registered')
+        # Parameters after (update, context) that have no default
+        required = sum(
+            parameter.default is parameter.empty
+            for parameter in list(inspect.signature(handler).parameters.values())[2:]
+        )
+        self._routes[route] = (handler, converters, required)
+
+    def resolve(self, data):
+        """(route, handler, converted args) for callback_data, or None"""
+        decoded = decode(data)
+        if decoded is None:
+            return None
+        route, raw_args = decoded
+        entry = self._routes.get(route)
+        if entry is None:
+            return None
+        handler, converters, required = entry
+        if not required <= len(raw_args) <= len(converters):
+            return None
+        try:
+            args = [convert(value) for convert, value in zip(converters, raw_args)]
+        except ValueError:
+            return None
+        return route, handler, args
+
+    async def dispatch(self, update, context):
+        query = update.callback_query
+        resolved = self.resolve(query.data)
+        if resolved is None:
+            self.rejected += 1
+            callbacks_rejected.inc()
+            logger.warning('Ignoring unknown callback data %r from user %s', query.data, update.effective_user.id)
+            await query.answer('This button is no longer valid.')
+            return
+
+        route, handler, args = resolved
+        started = time.perf_counter()
+        try:
+            async with track_handler(handler.__name__):
+                await handler(update, context, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.calls[route] += 1
+            self.seconds[route] += elapsed
+            self.slowest[route] = max(self.slowest[route], elapsed)
+            logger.debug('Callback %s handled in %.1f ms', route, elapsed * 1000)
+
+    def stats(self):
+        """Calls, average and slowest dispatch time per route"""
+        return {
+            route: {
+                'calls': calls,
+                'avg_ms': self.seconds[route] / calls * 1000,
+                'max_ms': self.slowest[route] * 1000,
+            }
+            for route, calls in self.calls.items()
+        }
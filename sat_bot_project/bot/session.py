@@ -0,0 +1,95 @@
+import time
+
+QUESTIONS_PER_MODULE = 27
+UNANSWERED = ord('-')
+
+
+class TestSession:
+    """State of one test attempt, stored in user_data['session'].
+
+    Answers are one fixed-size bytearray per module holding the ASCII letter
+    of each answer (or '-'), which lines up with the module's answer key, and
+    timestamps are epoch seconds.
+    """
+
+    __slots__ = (
+        'test_id', 'test_name', 'module', 'question', 'answers1', 'answers2',
+        'module1_start', 'module2_start', 'module1_time', 'module1_correct',
+        'module1_total', 'deadline',
+    )
+
+    def __init__(self, test_id, test_name, now=None):
+        self.test_id = test_id
+        self.test_name = test_name
+        self.module = 1
+        self.question = 0
+        self.answers1 = bytearray(b'-' * QUESTIONS_PER_MODULE)
+        self.answers2 = bytearray(b'-' * QUESTIONS_PER_MODULE)
+        self.module1_start = int(time.time() if now is None else now)
+        self.module2_start = None
+        self.module1_time = None
+        self.module1_correct = None
+        self.module1_total = None
+        # Epoch second at which the running module closes; None between modules
+        self.deadline = None
+
+    def answers(self, module):
+        return self.answers1 if module == 1 else self.answers2
+
+    def answer(self, module, index):
+        """The letter chosen for a question, or None"""
+        value = self.answers(module)[index]
+        return None if value == UNANSWERED else chr(value)
+
+    def set_answer(self, module, index, letter):
+        self.answers(module)[index] = ord(letter)
+
+    def module_start(self, module):
+        return self.module1_start if module == 1 else self.module2_start
+
+    def in_progress(self, module):
+        """Whether the given module is the one currently running"""
+        return self.deadline is not None and self.module == module
+
+    @classmethod
+    def from_legacy(cls, user_data):
+        """Convert a pre-TestSession dict session (module1_q12 keys, datetimes)"""
+        session = cls(user_data['test_id'], user_data.get('test_name', ''))
+        session.module = user_data.get('current_module', 1)
+        session.question = user_data.get('current_question', 0)
+        for key, letter in user_data.get('answers', {}).items():
+            module, _, index = key[len('module'):].partition('_q')
+            session.set_answer(int(module), int(index), letter)
+        session.module1_start = int(user_data['module1_start'].timestamp())
+        if 'module2_start' in user_data:
+            session.module2_start = int(user_data['module2_start'].timestamp())
+        session.module1_time = user_data.get('module1_time')
+        if 'module1_results' in user_data:
+            session.module1_correct, session.module1_total = user_data['module1_results']
+        if user_data.get('module_deadline'):
+            session.deadline = user_data['module_deadline'][1]
+        return session
+
+
+LEGACY_KEYS = (
+    'test_id', 'test_name', 'current_module', 'current_question', 'answers',
+    'module1_start', 'module2_start', 'module1_time', 'module1_results', 'module_deadline',
+)
+
+
+def peek_session(user_data):
+    """The user's TestSession, reading a legacy dict session without upgrading it"""
+    session = user_data.get('session')
+    if session is None and 'test_id' in user_data:
+        session = TestSession.from_legacy(user_data)
+    return session
+
+
+def get_session(user_data):
+    """The user's TestSession, upgrading a legacy dict session in place"""
+    session = user_data.get('session')
+    if session is None and 'test_id' in user_data:
+        session = user_data['session'] = TestSession.from_legacy(user_data)
+        for key in LEGACY_KEYS:
+            user_data.pop(key, None)
+    return session
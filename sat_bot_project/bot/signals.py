@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Test, Question, User, TestResult, ScoreBucket
+from .cache import invalidate_test, user_profiles
+from .images import schedule_optimization
+from .metrics import time_query
+
+
+@receiver(pre_save, sender=Question)
+@receiver(pre_save, sender=Test)
+def track_image_change(sender, instance, update_fields=None, **kwargs):
+    """Forget the optimized image and Telegram file_id when the admin replaces or removes the image"""
+    instance._image_changed = False
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    old_image = sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first() if instance.pk else None
+    if (old_image or '') == (instance.image.name or ''):
+        return
+    instance._image_changed = True
+    instance.image_optimized = ''
+    if sender is Question:
+        instance.image_file_id = ''
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=Test)
+def optimize_new_image(sender, instance, **kwargs):
+    """Make the Telegram-sized copy of a newly uploaded image"""
+    if getattr(instance, '_image_changed', False) and instance.image:
+        schedule_optimization(instance)
+
+
+@receiver([post_save, post_delete], sender=Question)
+def invalidate_question_bank(sender, instance, **kwargs):
+    """Drop the cached question bank of the question's test"""
+    invalidate_test(instance.test_id)
+
+
+@receiver([post_save, post_delete], sender=Test)
+def invalidate_test_bank(sender, instance, **kwargs):
+    """Drop the cached question bank when a test changes"""
+    invalidate_test(instance.pk)
+
+
+@receiver(pre_save, sender=User)
+def forget_old_telegram_id(sender, instance, **kwargs):
+    """Drop the cached profile under the Telegram id a user had before this save"""
+    if instance.pk:
+        old_telegram_id = sender.objects.filter(pk=instance.pk).values_list('telegram_id', flat=True).first()
+        if old_telegram_id is not None:
+            user_profiles.invalidate(old_telegram_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_user_profile(sender, instance, **kwargs):
+    """Drop the cached profile of a user whose row changed"""
+    if instance.telegram_id is not None:
+        user_profiles.invalidate(instance.telegram_id)
+
+
+@receiver(post_save, sender=TestResult)
+def count_result_score(sender, instance, created, **kwargs):
+    """Add a new result to its test's score histogram"""
+    if created:
+        ScoreBucket.add(instance.test_id, instance.estimated_score)
+
+
+@receiver(post_delete, sender=TestResult)
+def uncount_result_score(sender, instance, **kwargs):
+    """Take a deleted result out of its test's score histogram"""
+    ScoreBucket.add(instance.test_id, instance.estimated_score, -1)
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS (WAL, busy timeout, ...) to every new SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+@receiver(connection_created)
+def track_query_time(sender, connection, **kwargs):
+    """Record every query's duration for the metrics endpoint"""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
@@ -1,3 +1,976 @@
-from django.test import TestCase
+from django.contrib.auth.models import User as AdminUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from types import SimpleNamespace
+from unittest import skipUnless
+from unittest.mock import AsyncMock, patch
+from PIL import Image
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import Application
+from django.test.utils import CaptureQueriesContext
+from io import StringIO
+import io
+import os
+import asyncio
+import csv
+import tempfile
+import threading
+import time
+from datetime import datetime
+import random
 
-# Create your tests here.
+from .models import BotSession, ItemStatistic, Test, Question, TestResult, User, ScoreBucket
+from .cache import (
+    get_module_bank, invalidate_test, load_module_bank, load_user_profile, question_bank, user_profiles, warm_test,
+)
+from .export import csv_lines, result_rows
+from .images import optimize_image, store_optimized
+from .persistence import DjangoPersistence
+from .db import database_sync_to_async
+from .management.commands.item_analysis import analyze_items, np
+from .metrics import Histogram, application_gauges, metrics_view, render_metrics
+from .render import SELECTIONS, api_calls, question_screen, render
+from .concurrency import ChatOrderedUpdateProcessor
+from .ratelimit import OutboundRateLimiter
+from .timers import ModuleTimers
+from .webhook import SECRET_HEADER, IntakeQueue, telegram_webhook
+from .handler import expire_module, router
+from . import main
+from .main import grade, standing_text, load_results_page, load_results_summary, results_cursor, results_text
+from .session import TestSession, get_session
+
+
+def create_complete_test(name='Practice Test', seed=0):
+    """A test with 27 questions in each module and random correct answers"""
+    rng = random.Random(seed)
+    test = Test.objects.create(name=name)
+    Question.objects.bulk_create([
+        Question(
+            test=test,
+            module=module,
+            question_number=number,
+            question_text=f'Question {number}',
+            option_a='A', option_b='B', option_c='C', option_d='D',
+            correct_answer=rng.choice('ABCD'),
+        )
+        for module in (1, 2)
+        for number in range(1, 28)
+    ])
+    Test.objects.filter(pk=test.pk).update(is_complete=True)
+    return test
+
+
+class AnswerKeyTests(TestCase):
+    def setUp(self):
+        self.test = create_complete_test()
+
+    def grade_per_row(self, answers, module):
+        questions = Question.objects.filter(test=self.test, module=module).order_by('question_number')
+        return sum(
+            1 for i, question in enumerate(questions)
+            if answers.get(f'module{module}_q{i}') == question.correct_answer
+        )
+
+    def test_answer_key_grading_matches_per_row_grading(self):
+        rng = random.Random(1)
+        for module in (1, 2):
+            bank = load_module_bank(self.test.pk, module)
+            self.assertEqual(len(bank.answer_key), 27)
+            for _ in range(200):
+                answers = {
+                    f'module{module}_q{i}': rng.choice('ABCD')
+                    for i in range(27) if rng.random() < 0.8
+                }
+                session = TestSession(self.test.pk, self.test.name)
+                for key, letter in answers.items():
+                    session.set_answer(module, int(key.rpartition('_q')[2]), letter)
+                self.assertEqual(
+                    grade(bank.answer_key, session.answers(module)),
+                    self.grade_per_row(answers, module),
+                )
+
+    def test_answer_key_refreshes_when_a_question_changes(self):
+        question_bank.set((self.test.pk, 1), load_module_bank(self.test.pk, 1))
+        question = Question.objects.get(test=self.test, module=1, question_number=5)
+        question.correct_answer = 'D' if question.correct_answer != 'D' else 'A'
+        question.save()
+
+        self.assertIsNone(question_bank.get((self.test.pk, 1)))
+        self.assertEqual(load_module_bank(self.test.pk, 1).answer_key[4:5], question.correct_answer.encode())
+
+    def test_bank_loaded_across_an_invalidation_is_not_cached(self):
+        def load_during_admin_edit(test_id, module):
+            invalidate_test(test_id)
+            return 'bank with the old questions'
+
+        question_bank.clear()
+        with patch('bot.cache.load_module_bank', load_during_admin_edit):
+            self.assertEqual(asyncio.run(get_module_bank(self.test.pk, 1)), 'bank with the old questions')
+        self.assertIsNone(question_bank.get((self.test.pk, 1)))
+
+        with patch('bot.cache.load_module_bank', lambda test_id, module: 'current bank'):
+            asyncio.run(get_module_bank(self.test.pk, 1))
+        self.assertEqual(question_bank.get((self.test.pk, 1)), 'current bank')
+        question_bank.clear()
+
+    def test_pre_rendered_screens_mark_the_selected_answer(self):
+        bank = load_module_bank(self.test.pk, 2)
+        self.assertEqual([len(states) for states in bank.screens], [len(SELECTIONS)] * 27)
+        for index in (0, 26):
+            for selected in SELECTIONS:
+                body, markup = bank.screens[index][SELECTIONS.index(selected)]
+                expected = question_screen(bank.questions[index], 2, index, 27, selected)
+                self.assertEqual((body, markup), expected)
+                checked = [row[0].text for row in markup.inline_keyboard[:4] if row[0].text.startswith('✅')]
+                self.assertEqual(checked, [f'✅ {selected}'] if selected else [])
+        last_row = bank.screens[26][0][1].inline_keyboard[-1]
+        self.assertEqual([button.callback_data for button in last_row], ['1q:2:25', '1f:2'])
+
+    def test_each_tap_answers_its_callback_query_once(self):
+        warm_test(self.test.pk)
+        session = TestSession(self.test.pk, self.test.name)
+        session.deadline = session.module1_start + main.MODULE_TIME_LIMIT
+        context = SimpleNamespace(user_data={'session': session}, bot_data={}, bot=AsyncMock())
+        taps = [
+            (main.answer_question, ('B',)),
+            (main.go_to_question, (1, 5)),
+            (main.next_question, ()),
+            (main.prev_question, ()),
+        ]
+        for handler, args in taps:
+            with self.subTest(handler=handler.__name__):
+                query = SimpleNamespace(answer=AsyncMock(), message=SimpleNamespace(chat_id=5, message_id=1, photo=()))
+                update = SimpleNamespace(callback_query=query, effective_user=SimpleNamespace(id=5),
+                                         effective_chat=SimpleNamespace(id=5))
+                asyncio.run(handler(update, context, *args))
+                self.assertEqual(query.answer.await_count, 1)
+        self.assertEqual(context.bot.edit_message_text.await_count, len(taps))
+
+
+class TestSessionTests(TestCase):
+    def test_legacy_session_is_upgraded_in_place(self):
+        user_data = {
+            'user': {'phone': '+998900000000'},
+            'test_id': 7,
+            'test_name': 'Practice Test',
+            'current_module': 2,
+            'current_question': 3,
+            'answers': {'module1_q0': 'B', 'module2_q26': 'D'},
+            'module1_start': datetime(2024, 1, 1, 9, 0),
+            'module2_start': datetime(2024, 1, 1, 9, 30),
+            'module1_time': 1500,
+            'module1_results': (20, 27),
+            'module_deadline': (2, 1704100000.0),
+        }
+        session = get_session(user_data)
+
+        self.assertEqual(set(user_data), {'user', 'session'})
+        self.assertEqual((session.module, session.question), (2, 3))
+        self.assertEqual(session.answer(1, 0), 'B')
+        self.assertEqual(session.answer(2, 26), 'D')
+        self.assertIsNone(session.answer(1, 1))
+        self.assertEqual(session.module2_start - session.module1_start, 30 * 60)
+        self.assertEqual((session.module1_correct, session.module1_total), (20, 27))
+        self.assertTrue(session.in_progress(2))
+        self.assertIs(get_session(user_data), session)
+
+
+class DatabasePoolTests(TransactionTestCase):
+    def test_calls_run_concurrently_on_pool_threads_with_fresh_connections(self):
+        User.objects.create(phone='+998900000003', first_name='A', last_name='B')
+        both_running = threading.Barrier(2, timeout=5)
+
+        @database_sync_to_async
+        def lookup():
+            # Both calls must be inside at once: a single shared thread would time out here
+            both_running.wait()
+            return threading.current_thread().name, User.objects.get(phone='+998900000003').first_name
+
+        async def scenario():
+            return await asyncio.gather(lookup(), lookup())
+
+        with patch('bot.db.close_old_connections') as close_old_connections:
+            results = asyncio.run(scenario())
+        self.assertEqual(close_old_connections.call_count, 2)
+        self.assertEqual([name for _, name in results], ['A', 'A'])
+        self.assertTrue(all(thread.startswith('bot-db') for thread, _ in results))
+        self.assertNotEqual(results[0][0], results[1][0])
+
+
+class DjangoPersistenceTests(TransactionTestCase):
+    def test_sessions_are_batched_upserted_and_restored(self):
+        session = TestSession(1, 'Practice Test', now=1000)
+        session.set_answer(1, 3, 'C')
+        writes = []
+        write = DjangoPersistence._write
+
+        def counted_write(pending):
+            writes.append(sorted(pending))
+            write(pending)
+
+        async def scenario():
+            persistence = DjangoPersistence()
+            await persistence.update_user_data(5, {'session': session, 'screen': (5, 7, False)})
+            await persistence.update_user_data(6, {'user': {'phone': '+998900000000'}})
+            await persistence.update_user_data(7, {'user': {'phone': '+998900000001'}})
+            await persistence.flush()
+            # A second run updates one session in place and drops another
+            await persistence.update_user_data(6, {'user': {'phone': '+998900000002'}})
+            await persistence.drop_user_data(7)
+            await persistence.flush()
+            return await DjangoPersistence().get_user_data()
+
+        with patch.object(DjangoPersistence, '_write', staticmethod(counted_write)):
+            restored = asyncio.run(scenario())
+
+        self.assertEqual(writes, [[5, 6, 7], [6, 7]])
+        self.assertEqual(BotSession.objects.count(), 2)
+        self.assertEqual(set(restored), {5, 6})
+        self.assertEqual(restored[6], {'user': {'phone': '+998900000002'}})
+        self.assertEqual(restored[5]['screen'], (5, 7, False))
+        self.assertEqual(restored[5]['session'].answer(1, 3), 'C')
+        self.assertEqual(restored[5]['session'].module1_start, 1000)
+
+
+class UserProfileCacheTests(TestCase):
+    def test_changing_a_user_drops_their_cached_profile(self):
+        user = User.objects.create(phone='+998900000001', first_name='A', last_name='B', telegram_id=42)
+        self.assertEqual(load_user_profile(42), {'phone': user.phone, 'first_name': 'A', 'last_name': 'B'})
+        self.assertIsNone(load_user_profile(43))
+
+        user_profiles.set(42, load_user_profile(42))
+        user.first_name = 'C'
+        user.save()
+        self.assertIsNone(user_profiles.get(42))
+
+        user_profiles.set(42, load_user_profile(42))
+        user.telegram_id = 43
+        user.save()
+        self.assertIsNone(user_profiles.get(42))
+
+
+class MyResultsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(phone='+998900000000', first_name='A', last_name='B')
+        self.tests = [create_complete_test(f'Test {i}', seed=i) for i in range(2)]
+        for i in range(12):
+            TestResult.objects.create(
+                user=self.user, test=self.tests[i % 2],
+                module1_correct=i, module2_correct=i, estimated_score=400 + i * 10,
+                module1_time_taken=60, module2_time_taken=60,
+            )
+        # Several results share a timestamp so the id breaks ties
+        TestResult.objects.filter(pk__in=TestResult.objects.order_by('id').values('pk')[4:8]).update(
+            test_date=TestResult.objects.order_by('id')[4].test_date
+        )
+
+    def test_keyset_pages_cover_every_result_once(self):
+        expected = list(TestResult.objects.order_by('-test_date', '-id').values_list('id', flat=True))
+        seen, pages = [], []
+        page, has_newer, has_older = load_results_page(self.user.phone, page_size=5)
+        self.assertFalse(has_newer)
+        while True:
+            pages.append(page)
+            seen += [result.id for result in page]
+            if not has_older:
+                break
+            page, has_newer, has_older = load_results_page(
+                self.user.phone, 'older', results_cursor(page[-1]), page_size=5
+            )
+            self.assertTrue(has_newer)
+        self.assertEqual(seen, expected)
+
+        # Walking back from the last page returns the same pages
+        newer, has_newer, _ = load_results_page(self.user.phone, 'newer', results_cursor(pages[-1][0]), page_size=5)
+        self.assertEqual(newer, pages[-2])
+        self.assertTrue(has_newer)
+
+    def test_stale_cursor_falls_back_to_the_first_page(self):
+        first_page, _, _ = load_results_page(self.user.phone, page_size=5)
+        oldest = TestResult.objects.order_by('test_date', 'id').first()
+        newest = TestResult.objects.order_by('-test_date', '-id').first()
+        stale = {'older': results_cursor(oldest), 'newer': results_cursor(newest)}
+        for direction, cursor in stale.items():
+            with self.subTest(direction=direction):
+                self.assertEqual(
+                    load_results_page(self.user.phone, direction, cursor, page_size=5),
+                    (first_page, False, True),
+                )
+
+    def test_summary_of_many_tests_fits_in_one_message(self):
+        for i in range(40):
+            test = Test.objects.create(name=f'{i:02d} ' + 'x' * 197)
+            TestResult.objects.create(
+                user=self.user, test=test, module1_correct=1, module2_correct=1, estimated_score=400,
+                module1_time_taken=60, module2_time_taken=60,
+            )
+        page, _, _ = load_results_page(self.user.phone)
+        summary = load_results_summary(self.user.phone)
+
+        with self.settings(RESULTS_SUMMARY_TESTS=5):
+            text = results_text(summary, page)
+        self.assertIn('📚 35 x', text)
+        self.assertNotIn('📚 34 x', text)
+        self.assertIn('… and 37 more tests', text)
+
+        with self.settings(RESULTS_SUMMARY_TESTS=100):
+            text = results_text(summary, page)
+        self.assertLessEqual(len(text), 4096)
+        self.assertIn('more tests', text)
+
+    def test_summary_is_aggregated_per_test(self):
+        with self.assertNumQueries(1):
+            summary = load_results_summary(self.user.phone)
+        self.assertEqual([row['id'] for row in summary], [self.tests[1].pk, self.tests[0].pk])
+        for row, test in zip(summary, self.tests[::-1]):
+            scores = list(TestResult.objects.filter(test=test).order_by('-test_date', '-id')
+                          .values_list('estimated_score', flat=True))
+            self.assertEqual(row['id'], test.pk)
+            self.assertEqual(row['attempts'], len(scores))
+            self.assertEqual(row['best'], max(scores))
+            self.assertAlmostEqual(row['average'], sum(scores) / len(scores))
+            self.assertEqual(row['last'], scores[0])
+
+
+class ScoreBucketTests(TestCase):
+    def setUp(self):
+        self.test = create_complete_test()
+        self.user = User.objects.create(phone='+998900000002', first_name='A', last_name='B')
+
+    def add_result(self, score):
+        return TestResult.objects.create(
+            user=self.user, test=self.test, module1_correct=0, module2_correct=0,
+            estimated_score=score, module1_time_taken=60, module2_time_taken=60,
+        )
+
+    def test_histogram_follows_results_and_matches_a_rebuild(self):
+        results = [self.add_result(score) for score in (400, 500, 500, 600, 700)]
+        self.assertEqual(ScoreBucket.standing(self.test.pk, 500), {'below': 1, 'same': 2, 'total': 5})
+        self.assertEqual(
+            standing_text(ScoreBucket.standing(self.test.pk, 600)),
+            '🏅 You scored better than 75% of students on this test (rank 2 of 5)\n\n',
+        )
+
+        results[0].delete()
+        self.assertEqual(ScoreBucket.standing(self.test.pk, 500), {'below': 0, 'same': 2, 'total': 4})
+        incremental = set(ScoreBucket.objects.filter(count__gt=0).values_list('test_id', 'score', 'count'))
+        call_command('rebuild_score_buckets', stdout=StringIO())
+        self.assertEqual(set(ScoreBucket.objects.values_list('test_id', 'score', 'count')), incremental)
+
+    def test_first_result_has_no_standing(self):
+        self.add_result(500)
+        self.assertEqual(standing_text(ScoreBucket.standing(self.test.pk, 500)), '')
+
+
+@skipUnless(np, 'item analysis needs NumPy')
+class ItemAnalysisTests(TestCase):
+    def test_statistics_of_a_miskeyed_question(self):
+        # Question 3's key says C, but the students who get the others right answer D
+        attempts = ['ABD', 'ABD', 'ABD', 'AB-', 'CAC', 'DCC', 'DAC', 'CB-']
+        answers = np.frombuffer(''.join(attempts).encode(), dtype=np.uint8).reshape(len(attempts), 3)
+        p_values, discrimination, shares = analyze_items(answers, np.frombuffer(b'ABC', dtype=np.uint8))
+
+        self.assertEqual(list(p_values), [0.5, 0.625, 0.375])
+        self.assertEqual(list(shares['chose_d']), [0.25, 0.0, 0.375])
+        self.assertEqual(list(shares['unanswered']), [0.0, 0.0, 0.25])
+        self.assertGreater(discrimination[0], 0)
+        self.assertLess(discrimination[2], 0)
+
+    def test_test_that_lost_a_question_is_skipped(self):
+        user = User.objects.create(phone='+998900000000', first_name='A', last_name='B')
+        complete, edited = create_complete_test('Complete'), create_complete_test('Edited', seed=1)
+        Question.objects.filter(test=edited, module=1, question_number=5).delete()
+        for test in (complete, edited):
+            TestResult.objects.create(
+                user=user, test=test, module1_correct=0, module2_correct=0, estimated_score=200,
+                module1_time_taken=60, module2_time_taken=60, answers='A' * 54,
+            )
+        out = StringIO()
+
+        call_command('item_analysis', min_attempts=1, stdout=out)
+
+        self.assertIn('Edited: 53 questions instead of 27 per module, skipped', out.getvalue())
+        self.assertEqual(ItemStatistic.objects.filter(question__test=complete).count(), 54)
+        self.assertFalse(ItemStatistic.objects.filter(question__test=edited).exists())
+
+
+class QueryPlanTests(TestCase):
+    def test_bot_queries_use_indexes(self):
+        call_command('check_query_plans', stdout=StringIO())
+
+    def test_models_match_migrations(self):
+        call_command('makemigrations', 'bot', check=True, dry_run=True, stdout=StringIO())
+
+
+class AdminChangelistQueryTests(TestCase):
+    def setUp(self):
+        self.client.force_login(AdminUser.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        self.user = User.objects.create(phone='+998900000000', first_name='A', last_name='B')
+
+    def add_rows(self, count):
+        for _ in range(count):
+            test = create_complete_test(seed=Test.objects.count())
+            TestResult.objects.create(
+                user=self.user, test=test, module1_correct=10, module2_correct=10,
+                estimated_score=420, module1_time_taken=60, module2_time_taken=60,
+            )
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for url in ('/admin/bot/test/', '/admin/bot/testresult/', '/admin/bot/question/'):
+            with self.subTest(url=url):
+                self.add_rows(1)
+                few = self.changelist_queries(url)
+                self.add_rows(5)
+                self.assertEqual(self.changelist_queries(url), few)
+
+    def test_export_action_streams_every_filtered_result(self):
+        self.add_rows(3)
+        test = Test.objects.order_by('pk').last()
+        response = self.client.post(f'/admin/bot/testresult/?test__id__exact={test.pk}', {
+            'action': 'export_csv', 'select_across': '1', 'index': '0',
+            '_selected_action': [test.results.get().pk],
+        })
+        self.assertTrue(response.streaming)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([(row['test'], row['phone'], row['estimated_score']) for row in rows],
+                         [(test.name, "'" + self.user.phone, '420')])
+
+    def test_exported_text_cannot_run_as_a_spreadsheet_formula(self):
+        User.objects.filter(pk=self.user.pk).update(first_name='=HYPERLINK("http://x")', last_name='@SUM(A1)')
+        self.add_rows(1)
+        rows = list(csv.DictReader(io.StringIO(''.join(csv_lines(result_rows(TestResult.objects.all()))))))
+        self.assertEqual(
+            (rows[0]['phone'], rows[0]['first_name'], rows[0]['last_name'], rows[0]['estimated_score']),
+            ("'+998900000000", '\'=HYPERLINK("http://x")', "'@SUM(A1)", '420'),
+        )
+
+
+def question_bank_csv(tests, bad_test=None):
+    """A CSV question bank with complete tests, and one invalid test if given"""
+    rows = StringIO()
+    writer = csv.writer(rows)
+    writer.writerow(['test', 'module', 'question_number', 'question_text',
+                     'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer'])
+    for name in tests:
+        for module in (1, 2):
+            for number in range(1, 28):
+                writer.writerow([name, module, number, f'Question {number}', 'a', 'b', 'c', 'd', 'B'])
+    if bad_test:
+        writer.writerow([bad_test, 1, 28, 'Question 28', 'a', 'b', 'c', 'd', 'B'])
+    return rows.getvalue().encode()
+
+
+class ImportTests(TestCase):
+    def test_admin_upload_creates_complete_tests_and_skips_invalid_ones(self):
+        self.client.force_login(AdminUser.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        upload = SimpleUploadedFile('bank.csv', question_bank_csv(['First', 'Second'], bad_test='Broken'))
+
+        response = self.client.post('/admin/bot/test/import/', {'file': upload})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Module 1 questions must be numbered 1-27')
+        self.assertQuerySetEqual(
+            Test.objects.order_by('name').values_list('name', 'is_complete'),
+            [('First', True), ('Second', True)],
+            transform=tuple,
+        )
+        self.assertEqual(Question.objects.filter(test__name='Second', correct_answer='B').count(), 54)
+
+    def test_malformed_files_are_reported_with_their_line(self):
+        self.client.force_login(AdminUser.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        row = '{"test": "T", "module": 1}\n'
+        cases = [
+            ('bank.jsonl', row + '{"test": "T",\n', 'line 2: invalid JSON'),
+            ('bank.jsonl', row + '\n["T", 1]\n', 'line 3: expected a JSON object'),
+            ('bank.jsonl', '{"test": "T", "module": 1, "question_number": 1, "option_a": "a", "correct_answer": "A"}\n',
+             'line 1: question_text, option_b, option_c, option_d must not be empty'),
+            ('bank.jsonl', (row + row).encode() + b'{"test": "\xe9"}\n', 'line 3: not UTF-8 text'),
+            ('bank.csv', question_bank_csv(['First']).replace(b'Question 2,', b'Question \xe9,'), 'line 3: not UTF-8 text'),
+        ]
+        for filename, content, message in cases:
+            with self.subTest(message=message):
+                content = content.encode() if isinstance(content, str) else content
+                upload = SimpleUploadedFile(filename, content)
+                response = self.client.post('/admin/bot/test/import/', {'file': upload}, follow=True)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, message)
+
+
+class ImageOptimizationTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.test = create_complete_test()
+        self.question = Question.objects.get(test=self.test, module=1, question_number=1)
+        Question.objects.filter(pk=self.question.pk).update(image='images/q.png', image_file_id='FILE')
+        self.question.refresh_from_db()
+
+    def test_photo_is_downscaled_rotated_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90° clockwise
+        exif[0x010f] = 'Phone'
+        with tempfile.NamedTemporaryFile(suffix='.png') as upload:
+            Image.new('RGBA', (4000, 3000), (200, 10, 10, 128)).save(upload, 'PNG', exif=exif)
+            upload.flush()
+
+            original, optimized = optimize_image(upload.name, 1280, 85)
+
+        with Image.open(io.BytesIO(optimized)) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (960, 1280))
+            self.assertEqual(dict(image.getexif()), {})
+        self.assertLess(len(optimized), original)
+
+    def test_telegram_file_id_is_kept_and_reused_on_the_next_render(self):
+        Question.objects.filter(pk=self.question.pk).update(image_file_id='')
+        path = self.question.image.path
+        os.makedirs(os.path.dirname(path))
+        Image.new('RGB', (20, 20)).save(path, 'PNG')
+        invalidate_test(self.test.pk)
+        warm_test(self.test.pk)
+        session = TestSession(self.test.pk, self.test.name)
+        session.deadline = session.module1_start + main.MODULE_TIME_LIMIT
+        sent = SimpleNamespace(chat_id=5, message_id=2, photo=[SimpleNamespace(file_id='FILE')])
+        context = SimpleNamespace(user_data={'session': session}, bot_data={}, bot=AsyncMock())
+        context.bot.send_photo.return_value = sent
+        update = SimpleNamespace(callback_query=SimpleNamespace(message=SimpleNamespace(chat_id=5, message_id=1, photo=())))
+
+        with patch.object(main, 'save_file_id', AsyncMock()) as save_file_id:
+            asyncio.run(main.show_question(update, context))
+            save_file_id.assert_awaited_once_with(self.question.pk, 'images/q.png', 'FILE')
+            self.assertNotEqual(context.bot.send_photo.await_args.kwargs['photo'], 'FILE')
+
+            update.callback_query.message = sent
+            asyncio.run(main.show_question(update, context))
+        media = context.bot.edit_message_media.await_args.kwargs['media']
+        self.assertEqual(media.media, 'FILE')
+        self.assertEqual(save_file_id.await_count, 1)
+        question_bank.clear()
+
+    def test_replacing_or_removing_the_image_forgets_the_file_id(self):
+        question = self.question
+        question.image = 'images/other.png'
+        question.save()
+        question.refresh_from_db()
+        self.assertEqual(question.image_file_id, '')
+
+        # An upload of the replaced image finishing late does not store its file_id
+        main.save_file_id.func.__wrapped__(question.pk, 'images/q.png', 'STALE')
+        question.refresh_from_db()
+        self.assertEqual(question.image_file_id, '')
+
+        Question.objects.filter(pk=question.pk).update(image_file_id='FILE')
+        question.refresh_from_db()
+        question.image = None
+        question.save()
+        question.refresh_from_db()
+        self.assertEqual(question.image_file_id, '')
+
+    def test_stored_derivative_forgets_the_file_id_and_the_cached_bank(self):
+        warm_test(self.test.pk)
+
+        self.assertIsNone(store_optimized(Question, self.question.pk, 'images/old.png', b'jpeg'))
+        self.assertIsNotNone(question_bank.get((self.test.pk, 1)))
+
+        name = store_optimized(Question, self.question.pk, 'images/q.png', b'jpeg')
+        self.question.refresh_from_db()
+        self.assertEqual((self.question.image_optimized.name, self.question.image_file_id), (name, ''))
+        self.assertIsNone(question_bank.get((self.test.pk, 1)))
+        question_bank.clear()
+
+
+class RenderTests(SimpleTestCase):
+    def render(self, screen, photo=None, keep_photo=False, errors=None):
+        """Render on a fake bot; returns the result, the bot and the API calls of the flow"""
+        bot = AsyncMock()
+        for method, error in (errors or {}).items():
+            getattr(bot, method).side_effect = error
+        flow = self.id()
+        result = asyncio.run(render(bot, screen, 'text', photo=photo, keep_photo=keep_photo, flow=flow))
+        calls = {method: n for (call_flow, method), n in api_calls.items() if call_flow == flow}
+        return result, bot, calls
+
+    def test_answer_on_a_photo_edits_only_the_caption(self):
+        _, bot, calls = self.render((5, 1, True), photo='FILE', keep_photo=True)
+        self.assertEqual(calls, {'edit_message_caption': 1})
+        self.assertEqual(bot.edit_message_caption.await_args.kwargs['caption'], 'text')
+
+    def test_photo_to_photo_edits_the_media(self):
+        _, bot, calls = self.render((5, 1, True), photo='FILE')
+        self.assertEqual(calls, {'edit_message_media': 1})
+        self.assertEqual(bot.edit_message_media.await_args.kwargs['media'].media, 'FILE')
+
+    def test_text_to_text_edits_the_text(self):
+        _, _, calls = self.render((5, 1, False))
+        self.assertEqual(calls, {'edit_message_text': 1})
+
+    def test_switch_between_text_and_photo_deletes_and_sends(self):
+        _, bot, calls = self.render((5, 1, False), photo='FILE')
+        self.assertEqual(calls, {'delete_message': 1, 'send_photo': 1})
+        self.assertEqual(bot.send_photo.await_args.kwargs['photo'], 'FILE')
+
+        _, _, calls = self.render((5, 1, True))
+        self.assertEqual(calls, {'delete_message': 2, 'send_photo': 1, 'send_message': 1})
+
+    def test_screen_without_a_message_only_sends(self):
+        _, _, calls = self.render((5, None, False))
+        self.assertEqual(calls, {'send_message': 1})
+
+    def test_unchanged_message_is_left_alone(self):
+        result, bot, calls = self.render(
+            (5, 1, True), photo='FILE', errors={'edit_message_media': BadRequest('Message is not modified')}
+        )
+        self.assertIsNone(result)
+        self.assertEqual(calls, {'edit_message_media': 1})
+        bot.delete_message.assert_not_awaited()
+
+    def test_message_that_cannot_be_edited_is_replaced(self):
+        with self.assertLogs('bot.render', 'WARNING') as logs:
+            result, bot, calls = self.render((5, 1, False), errors={
+                'edit_message_text': BadRequest('Message to edit not found'),
+                'delete_message': BadRequest('Message to delete not found'),
+            })
+        self.assertEqual(len(logs.output), 2)
+        self.assertEqual(calls, {'edit_message_text': 1, 'delete_message': 1, 'send_message': 1})
+        self.assertIs(result, bot.send_message.return_value)
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_edits_go_before_queued_messages(self):
+        async def scenario():
+            limiter = OutboundRateLimiter(overall_rate=50, overall_burst=1, chat_rate=1000, chat_burst=1000)
+            order = []
+
+            async def call(name):
+                order.append(name)
+                return True
+
+            sends = [
+                asyncio.create_task(limiter.process_request(call, (f'send{i}',), {}, 'sendMessage', {'chat_id': i + 1}, None))
+                for i in range(4)
+            ]
+            await asyncio.sleep(0)
+            edit = limiter.process_request(call, ('edit',), {}, 'editMessageText', {'chat_id': 99}, None)
+            await asyncio.gather(*sends, edit)
+            await limiter.shutdown()
+            return order, limiter.stats()
+
+        order, stats = asyncio.run(scenario())
+        self.assertEqual(order[:2], ['send0', 'edit'])
+        self.assertEqual(stats['bulk']['calls'], 4)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_retry_after_pauses_and_retries(self):
+        attempts = []
+
+        async def flooded():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(1)
+            return True
+
+        limiter = OutboundRateLimiter()
+        self.assertTrue(asyncio.run(limiter.process_request(flooded, (), {}, 'sendMessage', {'chat_id': 1}, None)))
+        self.assertGreaterEqual(attempts[1] - attempts[0], 1)
+        self.assertEqual(limiter.stats()['retry_after'], 1)
+
+
+    def test_a_burst_of_taps_from_one_chat_does_not_stall(self):
+        async def scenario():
+            limiter = OutboundRateLimiter()
+
+            async def call():
+                return True
+
+            started = time.monotonic()
+            for _ in range(10):
+                await limiter.process_request(call, (), {}, 'answerCallbackQuery', {'callback_query_id': '1'}, None)
+                await limiter.process_request(call, (), {}, 'editMessageText', {'chat_id': 1}, None)
+            elapsed = time.monotonic() - started
+            await limiter.shutdown()
+            return elapsed, limiter.stats()
+
+        elapsed, stats = asyncio.run(scenario())
+        self.assertLess(elapsed, 0.1)
+        self.assertEqual(stats['interactive']['delayed'], 0)
+
+
+class ChatOrderedUpdateProcessorTests(SimpleTestCase):
+    def test_one_chat_in_order_different_chats_concurrently(self):
+        events = []
+
+        async def handle(name, delay):
+            events.append(f'start {name}')
+            await asyncio.sleep(delay)
+            events.append(f'end {name}')
+
+        async def scenario():
+            processor = ChatOrderedUpdateProcessor(8)
+            updates = [(1, 'a', 0.03), (1, 'b', 0.01), (2, 'x', 0.0), (1, 'c', 0.0)]
+            await asyncio.gather(*(
+                processor.process_update(SimpleNamespace(effective_chat=SimpleNamespace(id=chat)), handle(name, delay))
+                for chat, name, delay in updates
+            ))
+            return processor.active_chats
+
+        self.assertEqual(asyncio.run(scenario()), 0)
+        chat1 = [event for event in events if event[-1] in 'abc']
+        self.assertEqual(chat1, ['start a', 'end a', 'start b', 'end b', 'start c', 'end c'])
+        self.assertLess(events.index('end x'), events.index('end a'))
+
+    def test_locks_are_dropped_once_idle_even_after_errors(self):
+        async def fail():
+            raise ValueError
+
+        async def scenario():
+            processor = ChatOrderedUpdateProcessor(8)
+            for chat in range(100):
+                async with processor.chat_lock(chat):
+                    self.assertEqual(processor.active_chats, 1)
+            with self.assertRaises(ValueError):
+                await processor.process_update(SimpleNamespace(effective_chat=SimpleNamespace(id=1)), fail())
+            return processor.active_chats
+
+        self.assertEqual(asyncio.run(scenario()), 0)
+
+    def test_burst_from_one_chat_holds_a_single_slot(self):
+        async def scenario():
+            processor = ChatOrderedUpdateProcessor(2)
+            release, other_chat_done = asyncio.Event(), asyncio.Event()
+
+            async def slow():
+                await release.wait()
+
+            async def fast():
+                other_chat_done.set()
+
+            burst = [
+                asyncio.create_task(processor.process_update(SimpleNamespace(effective_chat=SimpleNamespace(id=1)), slow()))
+                for _ in range(5)
+            ]
+            other = asyncio.create_task(processor.process_update(SimpleNamespace(effective_chat=SimpleNamespace(id=2)), fast()))
+            await asyncio.wait_for(other_chat_done.wait(), 1)
+            await other
+            busy = processor.current_concurrent_updates
+            release.set()
+            await asyncio.gather(*burst)
+            return busy, processor.current_concurrent_updates
+
+        self.assertEqual(asyncio.run(scenario()), (1, 0))
+
+
+@override_settings(TELEGRAM_WEBHOOK_SECRET='s3cret', TELEGRAM_WEBHOOK_PUT_TIMEOUT=0.01)
+class WebhookTests(SimpleTestCase):
+    def post(self, application, **headers):
+        request = RequestFactory().post('/bot/webhook/', {'update_id': 1}, content_type='application/json',
+                                        headers=headers)
+        with patch('bot.webhook.get_application', AsyncMock(return_value=application)):
+            return asyncio.run(telegram_webhook(request))
+
+    def test_requests_without_the_secret_are_refused(self):
+        application = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+        for headers in ({}, {SECRET_HEADER: 'wrong'}):
+            with self.subTest(headers=headers):
+                self.assertEqual(self.post(application, **headers).status_code, 403)
+        with override_settings(TELEGRAM_WEBHOOK_SECRET=''):
+            self.assertEqual(self.post(application, **{SECRET_HEADER: ''}).status_code, 403)
+        self.assertTrue(application.update_queue.empty())
+
+    def test_full_intake_queue_asks_telegram_to_retry(self):
+        application = SimpleNamespace(bot=None, update_queue=IntakeQueue(1))
+        self.assertEqual(self.post(application, **{SECRET_HEADER: 's3cret'}).status_code, 200)
+
+        response = self.post(application, **{SECRET_HEADER: 's3cret'})
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '1'))
+
+        application.update_queue.get_nowait()
+        application.update_queue.task_done()
+        self.assertEqual(self.post(application, **{SECRET_HEADER: 's3cret'}).status_code, 200)
+
+
+class ModuleTimerTests(SimpleTestCase):
+    def drive(self, scenario):
+        """Run scenario(timers, expired) with a timer that records what it closes"""
+        expired = []
+
+        async def on_expire(user_id, chat_id, module):
+            expired.append((user_id, chat_id, module))
+
+        async def run():
+            timers = ModuleTimers(on_expire)
+            await scenario(timers, expired)
+            await asyncio.sleep(0)
+
+        asyncio.run(run())
+        return expired
+
+    def test_deadlines_expire_in_order_and_cancelled_ones_never_do(self):
+        async def scenario(timers, expired):
+            timers.schedule(1, 11, 1, deadline=100)
+            timers.schedule(2, 22, 1, deadline=50)
+            timers.schedule(3, 33, 2, deadline=70)
+            timers.cancel(3)
+            self.assertEqual(len(timers), 2)
+
+            self.assertEqual(timers.expire_due(40), 10)
+            self.assertEqual(timers.expire_due(80), 20)
+            await asyncio.sleep(0)
+            self.assertEqual(expired, [(2, 22, 1)])
+            self.assertIsNone(timers.expire_due(100))
+            self.assertEqual(len(timers), 0)
+
+        self.assertEqual(self.drive(scenario), [(2, 22, 1), (1, 11, 1)])
+
+    def test_rescheduling_replaces_the_earlier_deadline(self):
+        async def scenario(timers, expired):
+            timers.schedule(1, 11, 1, deadline=100)
+            timers.schedule(1, 11, 2, deadline=200)
+            timers.expire_due(150)
+            await asyncio.sleep(0)
+            self.assertEqual(expired, [])
+            timers.expire_due(200)
+
+        self.assertEqual(self.drive(scenario), [(1, 11, 2)])
+
+    def test_running_timer_wakes_for_an_earlier_deadline(self):
+        async def scenario(timers, expired):
+            timers.schedule(1, 11, 1, deadline=time.time() + 60)
+            timers.start()
+            await asyncio.sleep(0)
+            timers.schedule(2, 22, 1, deadline=time.time() + 0.01)
+            await asyncio.sleep(0.05)
+            await timers.stop()
+
+        self.assertEqual(self.drive(scenario), [(2, 22, 1)])
+
+    def test_starting_and_ending_a_module_schedules_and_cancels_its_deadline(self):
+        async def scenario(timers, expired):
+            session = TestSession(1, 'Test', now=1000)
+            update = SimpleNamespace(effective_user=SimpleNamespace(id=5), effective_chat=SimpleNamespace(id=55))
+            context = SimpleNamespace(bot_data={'module_timers': timers})
+            main.start_module_timer(update, context, session)
+            self.assertEqual(session.deadline, 1000 + main.MODULE_TIME_LIMIT)
+            self.assertEqual(len(timers), 1)
+
+            main.stop_module_timer(update, context, session)
+            self.assertIsNone(session.deadline)
+            timers.expire_due(session.module1_start + 2 * main.MODULE_TIME_LIMIT)
+
+        self.assertEqual(self.drive(scenario), [])
+
+    def test_restored_sessions_get_their_deadlines_back(self):
+        running = TestSession(1, 'Test', now=1000)
+        running.deadline = 1000 + main.MODULE_TIME_LIMIT
+        finished = TestSession(1, 'Test', now=1000)
+        application = SimpleNamespace(user_data={
+            5: {'session': running, 'screen': (55, 7, False)},
+            6: {'session': running},
+            8: {'session': finished},
+            9: {},
+        })
+
+        async def scenario(timers, expired):
+            self.assertEqual(main.restore_module_timers(application, timers), 2)
+            timers.expire_due(running.deadline)
+
+        self.assertEqual(sorted(self.drive(scenario)), [(5, 55, 1), (6, 6, 1)])
+
+
+class ModuleExpiryTests(TestCase):
+    def test_expired_module_is_graded_and_the_user_told(self):
+        test = create_complete_test()
+        warm_test(test.pk)
+        application = Application.builder().token('1:test').updater(None).build()
+        session = TestSession(test.pk, test.name, now=time.time() - main.MODULE_TIME_LIMIT)
+        session.deadline = time.time()
+        correct = load_module_bank(test.pk, 1).answer_key[:3].decode()
+        for index, letter in enumerate(correct):
+            session.set_answer(1, index, letter)
+        application.user_data[5].update(session=session, screen=(55, 7, False))
+
+        with patch.object(main, 'render', AsyncMock()) as render, patch.object(main, 'schedule_followup'):
+            asyncio.run(expire_module(application, 5, 55, 1))
+
+        self.assertEqual((session.module, session.question, session.module1_correct), (2, 0, 3))
+        self.assertIsNone(session.deadline)
+        text = render.await_args.args[2]
+        self.assertTrue(text.startswith('⏰ Time is up!'))
+        self.assertIn('Results: 3/27', text)
+
+
+class CallbackRouterTests(SimpleTestCase):
+    def test_versioned_and_legacy_data_reach_the_same_handler(self):
+        cases = [
+            ('1a:C:2:26', main.answer_question, ['C', 2, 26]),
+            ('answer_C', main.answer_question, ['C']),
+            ('1t:12', main.start_test, [12]),
+            ('test_12', main.start_test, [12]),
+            ('1rp:older:1700000000000000:9', main.show_results_page, ['older', 1700000000000000, 9]),
+            ('results_older_1700000000000000_9', main.show_results_page, ['older', 1700000000000000, 9]),
+            ('finish_module', main.finish_module, []),
+            ('1f:2', main.finish_module, [2]),
+        ]
+        for data, handler, args in cases:
+            with self.subTest(data=data):
+                _, resolved_handler, resolved_args = router.resolve(data)
+                self.assertIs(resolved_handler, handler)
+                self.assertEqual(resolved_args, args)
+
+    def test_malformed_data_is_rejected(self):
+        for data in ('test_abc', '1a:E:1:1', '1q:1', '1q:1:2:3', '1zz', 'answer_', 'nonsense', ''):
+            with self.subTest(data=data):
+                self.assertIsNone(router.resolve(data))
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram('bot_test_seconds', 'Test', 'handler', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe('start', value)
+        self.assertEqual(histogram.render()[2:], [
+            'bot_test_seconds_bucket{handler="start",le="0.1"} 2',
+            'bot_test_seconds_bucket{handler="start",le="1.0"} 3',
+            'bot_test_seconds_bucket{handler="start",le="+Inf"} 4',
+            'bot_test_seconds_sum{handler="start"} 3.65',
+            'bot_test_seconds_count{handler="start"} 4',
+        ])
+
+    def test_every_metric_is_documented(self):
+        lines = render_metrics().splitlines()
+        names = {line.split()[2] for line in lines if line.startswith('# TYPE')}
+        for line in lines:
+            if not line.startswith('#'):
+                name = line.split('{')[0].split()[0]
+                self.assertTrue(any(name == n or name.startswith(n + '_') for n in names), line)
+
+    def test_endpoint_is_closed_without_a_token(self):
+        def scrape(authorization):
+            request = RequestFactory().get('/bot/metrics/', headers={'Authorization': authorization})
+            return asyncio.run(metrics_view(request)).status_code
+
+        with override_settings(BOT_METRICS_TOKEN=''):
+            self.assertEqual(scrape(''), 403)
+        with override_settings(BOT_METRICS_TOKEN='t0ken'):
+            self.assertEqual(scrape('Bearer wrong'), 403)
+            self.assertEqual(scrape('Bearer t0ken'), 200)
+
+    def test_scrape_leaves_legacy_sessions_alone(self):
+        legacy = {'test_id': 1, 'current_module': 2, 'module1_start': datetime(2025, 1, 1),
+                  'module_deadline': (2, 1735693200)}
+        application = SimpleNamespace(
+            user_data={5: legacy}, bot_data={}, update_processor=None,
+            bot=SimpleNamespace(rate_limiter=None),
+        )
+        lines = application_gauges(application)
+        self.assertIn('bot_active_sessions{module="2"} 1', lines)
+        self.assertNotIn('session', legacy)
+        self.assertEqual(legacy['current_module'], 2)
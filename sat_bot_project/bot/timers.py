@@ -0,0 +1,89 @@
+from itertools import count
+import asyncio
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ModuleTimers:
+    """One timer shared by every session, backed by a heap of module deadlines.
+
+    Scheduling is a heap push (O(log n)) and a single task sleeps until the
+    earliest deadline. Cancelled or rescheduled timers are dropped lazily
+    when they reach the top of the heap.
+    """
+
+    def __init__(self, on_expire):
+        self._on_expire = on_expire
+        self._heap = []
+        self._deadlines = {}
+        self._seq = count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._expiring = set()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def schedule(self, user_id, chat_id, module, deadline):
+        """Call on_expire(user_id, chat_id, module) at the epoch time deadline"""
+        self._deadlines[user_id] = (deadline, chat_id, module)
+        heapq.heappush(self._heap, (deadline, next(self._seq), user_id))
+        if self._heap[0][2] == user_id:
+            self._wakeup.set()
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+
+    def cancel(self, user_id):
+        self._deadlines.pop(user_id, None)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if self._is_current(entry)]
+        heapq.heapify(self._heap)
+
+    def _is_current(self, entry):
+        deadline, _, user_id = entry
+        timer = self._deadlines.get(user_id)
+        return timer is not None and timer[0] == deadline
+
+    def expire_due(self, now):
+        """Start on_expire for every deadline up to now; returns the seconds until the next one, or None"""
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if not self._is_current(entry):
+                continue
+            user_id = entry[2]
+            _, chat_id, module = self._deadlines.pop(user_id)
+            task = asyncio.create_task(self._expire(user_id, chat_id, module))
+            self._expiring.add(task)
+            task.add_done_callback(self._expiring.discard)
+        return self._heap[0][0] - now if self._heap else None
+
+    async def _run(self):
+        while True:
+            timeout = self.expire_due(time.time())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _expire(self, user_id, chat_id, module):
+        try:
+            await self._on_expire(user_id, chat_id, module)
+        except Exception:
+            logger.exception('Closing module %s for user %s failed', module, user_id)
@@ -0,0 +1,136 @@
+from telegram import Update
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed, HttpResponseBadRequest
+import asyncio
+import hmac
+import json
+import logging
+
+from .handler import build_application, log_stats
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class IntakeQueue(asyncio.Queue):
+    """Update queue bounded by updates in flight rather than updates waiting.
+
+    With concurrent processing the application takes updates off the queue
+    immediately, so a plain maxsize would never push back. Here a slot is only
+    freed by task_done(), which the application calls once an update has been
+    fully processed.
+    """
+
+    def __init__(self, maxsize):
+        super().__init__()
+        self.limit = maxsize
+        self._slots = asyncio.Semaphore(maxsize)
+
+    async def put(self, item):
+        await self._slots.acquire()
+        self.put_nowait(item)
+
+    def task_done(self):
+        super().task_done()
+        self._slots.release()
+
+
+_application = None
+_startup_lock = asyncio.Lock()
+
+
+async def get_application():
+    """Return the process-wide webhook Application, starting it on first use"""
+    global _application
+    if _application is None:
+        async with _startup_lock:
+            if _application is None:
+                queue = IntakeQueue(settings.TELEGRAM_WEBHOOK_QUEUE_SIZE)
+                application = build_application(update_queue=queue)
+                await application.initialize()
+                if application.post_init:
+                    await application.post_init(application)
+                await application.start()
+                _application = application
+                logger.info('Webhook bot is running...')
+    return _application
+
+
+async def stop_application():
+    """Stop the webhook Application and flush its persistence"""
+    global _application
+    async with _startup_lock:
+        if _application is None:
+            return
+        application, _application = _application, None
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        log_stats(application)
+
+
+async def telegram_webhook(request):
+    """Receive an update from Telegram and queue it for the shared Application.
+
+    Requests must carry the secret token given to setWebhook. When the intake
+    queue stays full for TELEGRAM_WEBHOOK_PUT_TIMEOUT seconds the update is
+    refused with 503 so Telegram retries it later.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    secret = settings.TELEGRAM_WEBHOOK_SECRET
+    token = request.headers.get(SECRET_HEADER, '')
+    if not secret or not hmac.compare_digest(token.encode(), secret.encode()):
+        return HttpResponseForbidden()
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    application = await get_application()
+    update = Update.de_json(data, application.bot)
+
+    try:
+        await asyncio.wait_for(
+            application.update_queue.put(update),
+            timeout=settings.TELEGRAM_WEBHOOK_PUT_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.warning('Update queue full, refusing update %s', update.update_id)
+        response = HttpResponse(status=503)
+        response['Retry-After'] = '1'
+        return response
+
+    return HttpResponse()
+
+# Telegram cannot send a CSRF token
+telegram_webhook.csrf_exempt = True
+
+
+def with_bot_lifespan(asgi_app):
+    """Wrap an ASGI app so the webhook Application starts and stops with the server"""
+    async def app(scope, receive, send):
+        if scope['type'] != 'lifespan':
+            return await asgi_app(scope, receive, send)
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    if settings.TELEGRAM_WEBHOOK_SECRET:
+                        await get_application()
+                except Exception as e:
+                    logger.exception('Could not start the webhook bot')
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await stop_application()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    return app
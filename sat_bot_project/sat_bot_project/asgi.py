@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "sat_bot_project.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from bot.webhook import with_bot_lifespan  # noqa: E402 (needs Django set up)
+
+# Starts the webhook bot on server startup and flushes its sessions on shutdown
+application = with_bot_lifespan(django_application)
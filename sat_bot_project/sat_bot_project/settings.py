@@ -27,10 +27,56 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.getenv('ALLOWED_HOSTS', '').split(',') if host]
 # Application definition
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
+# In-process cache of each test's ordered questions per module
+QUESTION_CACHE_SIZE = int(os.getenv('QUESTION_CACHE_SIZE', 256))
+QUESTION_CACHE_TTL = int(os.getenv('QUESTION_CACHE_TTL', 300))
+
+# In-process cache of registered users by Telegram id, used to log in on /start
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 4096))
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', 600))
+
+# Seconds between batched writes of bot sessions to the database
+BOT_PERSISTENCE_INTERVAL = float(os.getenv('BOT_PERSISTENCE_INTERVAL', 10))
+
+# Updates processed at once (updates of one chat always run in order)
+BOT_CONCURRENT_UPDATES = int(os.getenv('BOT_CONCURRENT_UPDATES', 256))
+
+# Outgoing Bot API calls per second: overall, and per chat with a short burst
+BOT_RATE_OVERALL = float(os.getenv('BOT_RATE_OVERALL', 30))
+BOT_RATE_PER_CHAT = float(os.getenv('BOT_RATE_PER_CHAT', 1))
+BOT_RATE_CHAT_BURST = int(os.getenv('BOT_RATE_CHAT_BURST', 3))
+
+# Threads running the bot's database queries (one connection each)
+BOT_DB_THREADS = int(os.getenv('BOT_DB_THREADS', 16))
+
+# Webhook mode (served by the ASGI app at /bot/webhook/); empty secret disables it
+TELEGRAM_WEBHOOK_SECRET = os.getenv('TELEGRAM_WEBHOOK_SECRET', '')
+TELEGRAM_WEBHOOK_QUEUE_SIZE = int(os.getenv('TELEGRAM_WEBHOOK_QUEUE_SIZE', 1000))
+TELEGRAM_WEBHOOK_PUT_TIMEOUT = float(os.getenv('TELEGRAM_WEBHOOK_PUT_TIMEOUT', 5))
+
+# Prometheus metrics: served at /bot/metrics/ in webhook mode, and on a side
+# server at BOT_METRICS_HOST:BOT_METRICS_PORT/metrics when the port is set.
+# Scrapes must send "Authorization: Bearer <BOT_METRICS_TOKEN>"; /bot/metrics/
+# refuses every scrape until it is set, the side server only checks it when set
+BOT_METRICS_HOST = os.getenv('BOT_METRICS_HOST', '127.0.0.1')
+BOT_METRICS_PORT = int(os.getenv('BOT_METRICS_PORT', 0))
+BOT_METRICS_TOKEN = os.getenv('BOT_METRICS_TOKEN', '')
+
+# Test results shown per page of "My Results"
+RESULTS_PAGE_SIZE = int(os.getenv('RESULTS_PAGE_SIZE', 5))
+# Tests summarized above them, most recently taken first
+RESULTS_SUMMARY_TESTS = int(os.getenv('RESULTS_SUMMARY_TESTS', 10))
+
+# Uploaded images are copied to a JPEG at most this many pixels on a side
+# (Telegram's photo size) in background processes
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 1280))
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', 85))
+IMAGE_OPTIMIZER_PROCESSES = int(os.getenv('IMAGE_OPTIMIZER_PROCESSES', 2))
+
 INSTALLED_APPS = [
     "django.contrib.admin",
     "django.contrib.auth",
@@ -74,12 +120,53 @@ WSGI_APPLICATION = "sat_bot_project.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DATABASE_PROFILE=sqlite (default) or postgres
+DATABASE_PROFILE = os.getenv("DATABASE_PROFILE", "sqlite")
+
+if DATABASE_PROFILE == "postgres":
+    # Needs psycopg 3; the pool also needs psycopg-pool (pip install "psycopg[binary,pool]")
+    # and Django 5.1+ (see the optional lines in requirements.txt)
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("POSTGRES_DB", "sat_bot"),
+            "USER": os.getenv("POSTGRES_USER", "postgres"),
+            "PASSWORD": os.getenv("POSTGRES_PASSWORD", ""),
+            "HOST": os.getenv("POSTGRES_HOST", "localhost"),
+            "PORT": os.getenv("POSTGRES_PORT", "5432"),
+            # Persistent connection per thread, kept for this many seconds
+            "CONN_MAX_AGE": int(os.getenv("POSTGRES_CONN_MAX_AGE", 60)),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
+    }
+    # POSTGRES_POOL_SIZE > 0 switches to a shared connection pool, which
+    # replaces persistent connections (Django requires CONN_MAX_AGE=0 then).
+    # Keep it at least BOT_DB_THREADS.
+    POSTGRES_POOL_SIZE = int(os.getenv("POSTGRES_POOL_SIZE", 0))
+    if POSTGRES_POOL_SIZE:
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv("POSTGRES_POOL_MIN_SIZE", 2)),
+            "max_size": POSTGRES_POOL_SIZE,
+            "timeout": float(os.getenv("POSTGRES_POOL_TIMEOUT", 10)),
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+            "CONN_MAX_AGE": None,
+        }
+    }
+    # Applied to every new SQLite connection (bot/signals.py). WAL lets the
+    # bot keep reading while the admin or a finished test writes.
+    SQLITE_PRAGMAS = {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000)),
+        "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
     }
-}
 
 
 # Password validation
@@ -19,7 +19,11 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
+from bot.webhook import telegram_webhook
+from bot.metrics import metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("bot/webhook/", telegram_webhook, name="telegram_webhook"),
+    path("bot/metrics/", metrics_view, name="bot_metrics"),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)